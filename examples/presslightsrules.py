@@ -0,0 +1,11 @@
+import pifacedigitalio
+from pifacedigitalio.rules import Follow
+
+
+if __name__ == "__main__":
+    pifacedigital = pifacedigitalio.PiFaceDigital()
+    # the same as presslights.py, without the callbacks
+    pifacedigital.set_rules([Follow(i, i) for i in range(4)])
+
+    listener = pifacedigitalio.InputEventListener(chip=pifacedigital)
+    listener.activate()
@@ -1,13 +1,84 @@
+import os
+import collections
+import ctypes
+import errno
+import json
+import logging
+import select
+import threading
+import time
+import warnings
+from fcntl import ioctl
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
 import pifacecommon.mcp23s17
 import pifacecommon.interrupts
+from pifacecommon.linux_spi_spidev import spi_ioc_transfer, SPI_IOC_MESSAGE
+from .rules import RuleTable
+from .mirror import StatePublisher, mirror_path
+from .timerwheel import timer_wheel
+
+
+logger = logging.getLogger(__name__)
 
 # /dev/spidev<bus>.<chipselect>
 DEFAULT_SPI_BUS = 0
 DEFAULT_SPI_CHIP_SELECT = 0
 
-MAX_BOARDS = 4
-# list of PiFace Digitals for digital_read/digital_write
-_pifacedigitals = [None] * MAX_BOARDS
+MAX_BOARDS = 4  # per chip select
+# PiFace Digitals for digital_read/digital_write, keyed by
+# (bus, chip_select, hardware_addr)
+_pifacedigitals = dict()
+
+# the MCP23S17 is rated to 10MHz
+MAX_SPI_SPEED_HZ = 10000000
+# SPI clock speeds tried by PiFaceDigital.autotune_spi_speed
+SPI_SPEEDS_HZ = (500000, 1000000, 2000000, 4000000, 5000000, 8000000,
+                 10000000)
+# tuned speeds are remembered here, keyed by bus.chip_select.hardware_addr
+SPI_SPEED_CACHE_FILE = os.path.expanduser(
+    "~/.cache/pifacedigitalio/spi_speed.json")
+
+# registers set by PiFaceDigital.init_board (other than IOCON and GPIOA)
+BOARD_CONFIG = {
+    pifacecommon.mcp23s17.IODIRA: 0,  # GPIOA as outputs
+    pifacecommon.mcp23s17.IODIRB: 0xFF,  # GPIOB as inputs
+    pifacecommon.mcp23s17.GPPUB: 0xFF,  # input pullups on
+    pifacecommon.mcp23s17.GPINTENB: 0xFF,  # interrupts on
+    pifacecommon.mcp23s17.INTCONB: 0,  # interrupt on change
+}
+
+IOCON_CONFIG = (
+    pifacecommon.mcp23s17.BANK_OFF |
+    pifacecommon.mcp23s17.INT_MIRROR_OFF |
+    pifacecommon.mcp23s17.SEQOP_ON |  # for read_registers/write_registers
+    pifacecommon.mcp23s17.DISSLW_OFF |
+    pifacecommon.mcp23s17.HAEN_ON |
+    pifacecommon.mcp23s17.ODR_OFF |
+    pifacecommon.mcp23s17.INTPOL_LOW
+)
+
+# IODIRA to GPPUB, the registers kept in memory by PiFaceDigital
+CONFIG_REGISTERS = pifacecommon.mcp23s17.GPPUB + 1
+
+# what a full InputEventListener event queue does with another event
+OVERFLOW_DROP_OLDEST = "drop oldest"
+OVERFLOW_DROP_NEWEST = "drop newest"
+OVERFLOW_COALESCE = "coalesce"  # replace the queued event for that pin
+OVERFLOW_BLOCK = "block"  # the detector waits for the dispatcher
+# orders port callbacks after the pin numbers
+PORT_KEY = 8
+
+# Python 2 has no monotonic clock
+_monotonic = getattr(time, 'monotonic', time.time)
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:
+    # Python < 3.7
+    def _monotonic_ns():
+        return int(_monotonic() * 1e9)
 
 
 class NoPiFaceDigitalDetectedError(Exception):
@@ -18,6 +89,47 @@ class NoPiFaceDigitalError(Exception):
     pass
 
 
+class OutputPin(pifacecommon.mcp23s17.MCP23S17RegisterBit):
+    """An output bit on a PiFace Digital. Toggling is a single locked
+    read-modify-write on the chip so concurrent updates are not lost.
+    """
+    def toggle(self):
+        self.chip.toggle_bits(1 << self.bit_num, self.address)
+
+    def pulse(self, duration):
+        """Turns the pin on for duration seconds without blocking. See
+        :meth:`PiFaceDigital.pulse_mask`.
+
+        :param duration: Seconds to stay on.
+        :type duration: float
+        :returns: :class:`pifacedigitalio.timerwheel.Pulse`
+        """
+        return self.chip.pulse_mask(1 << self.bit_num, duration)
+
+
+class OutputPort(pifacecommon.mcp23s17.MCP23S17Register):
+    """The output port on a PiFace Digital. Toggling is a single locked
+    read-modify-write on the chip so concurrent updates are not lost.
+    """
+    def toggle(self):
+        self.chip.toggle_bits(0xFF, self.address)
+
+
+class _NoLock(object):
+    """Stands in for a port lock when the caller owns the board."""
+    def acquire(self, blocking=True):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
 class PiFaceDigital(pifacecommon.mcp23s17.MCP23S17,
                     pifacecommon.interrupts.GPIOInterruptDevice):
     """A PiFace Digital board.
@@ -26,14 +138,10 @@ class PiFaceDigital(pifacecommon.mcp23s17.MCP23S17,
         :class:`pifacecommon.mcp23s17.MCP23S17RegisterBitNeg`.
     :attribute: input_port -- See
         :class:`pifacecommon.mcp23s17.MCP23S17RegisterNeg`.
-    :attribute: output_pins -- list containing
-        :class:`pifacecommon.mcp23s17.MCP23S17RegisterBit`.
-    :attribute: output_port -- See
-        :class:`pifacecommon.mcp23s17.MCP23S17Register`.
-    :attribute: leds --
-        list containing :class:`pifacecommon.mcp23s17.MCP23S17RegisterBit`.
-    :attribute: relays --
-        list containing :class:`pifacecommon.mcp23s17.MCP23S17RegisterBit`.
+    :attribute: output_pins -- list containing :class:`OutputPin`.
+    :attribute: output_port -- See :class:`OutputPort`.
+    :attribute: leds -- list containing :class:`OutputPin`.
+    :attribute: relays -- list containing :class:`OutputPin`.
     :attribute: switches --
         list containing :class:`pifacecommon.mcp23s17.MCP23S17RegisterBit`.
 
@@ -44,14 +152,58 @@ class PiFaceDigital(pifacecommon.mcp23s17.MCP23S17,
     0
     >>> pfd.output_port.value = 0xAA
     >>> pfd.leds[5].turn_on()
+
+    The SPI clock speed can be set with ``spi_speed_hz``. By default the
+    speed found by :meth:`autotune_spi_speed` for this board is used, or the
+    SPI driver's default if the board has not been tuned.
+
+    Writes to each port are serialised by a lock per port so that several
+    threads can drive the outputs at once. Pass ``thread_safe=False`` to
+    skip the locks when only one thread ever uses the board.
+
+    With ``attach=True`` the board is set up with :meth:`attach_board`
+    instead of :meth:`init_board`, so restarting a program does not glitch
+    the outputs. ``state_file`` names a file the outputs and pullups are
+    saved to whenever they change (see :meth:`save_state`) and restored
+    from when attaching to a board which has lost power.
+
+    ``backend`` replaces the SPI device and interrupt line, for example
+    with a :class:`pifacedigitalio.simulator.MCP23S17Simulator`.
     """
     def __init__(self,
                  hardware_addr=0,
                  bus=DEFAULT_SPI_BUS,
                  chip_select=DEFAULT_SPI_CHIP_SELECT,
-                 init_board=True):
+                 init_board=True,
+                 thread_safe=True,
+                 spi_speed_hz=None,
+                 attach=False,
+                 state_file=None,
+                 backend=None):
+        self.backend = backend
+        self.spi_errors = 0  # failed SPI transfers
+        self.resets = 0  # resets found by check_config
         super(PiFaceDigital, self).__init__(hardware_addr, bus, chip_select)
 
+        if spi_speed_hz is None:
+            spi_speed_hz = _load_spi_speeds().get(_spi_speed_key(self), 0)
+        self.spi_speed_hz = spi_speed_hz
+
+        # with BANK_OFF, port A registers are even and port B are odd
+        if thread_safe:
+            self._port_locks = (threading.RLock(), threading.RLock())
+        else:
+            self._port_locks = (_NoLock(), _NoLock())
+        self._output_latch = None  # last value written to GPIOA
+        self._config = None  # IODIRA to GPPUB, see config_register
+        self._rule_table = None
+        self._state_publisher = None
+        # inputs an active InputEventListener has callbacks for
+        self._listener_pins = None
+        self.state_file = state_file
+        self._state_lock = threading.Lock()
+        self._saved_state = None  # what state_file holds
+
         self.input_pins = [pifacecommon.mcp23s17.MCP23S17RegisterBitNeg(
             i, pifacecommon.mcp23s17.GPIOB, self)
             for i in range(8)]
@@ -59,66 +211,1039 @@ class PiFaceDigital(pifacecommon.mcp23s17.MCP23S17,
         self.input_port = pifacecommon.mcp23s17.MCP23S17RegisterNeg(
             pifacecommon.mcp23s17.GPIOB, self)
 
-        self.output_pins = [pifacecommon.mcp23s17.MCP23S17RegisterBit(
-            i, pifacecommon.mcp23s17.GPIOA, self)
-            for i in range(8)]
+        self.output_pins = [OutputPin(i, pifacecommon.mcp23s17.GPIOA, self)
+                            for i in range(8)]
 
-        self.output_port = pifacecommon.mcp23s17.MCP23S17Register(
-            pifacecommon.mcp23s17.GPIOA, self)
+        self.output_port = OutputPort(pifacecommon.mcp23s17.GPIOA, self)
 
-        self.leds = [pifacecommon.mcp23s17.MCP23S17RegisterBit(
-            i, pifacecommon.mcp23s17.GPIOA, self)
-            for i in range(8)]
+        self.leds = [OutputPin(i, pifacecommon.mcp23s17.GPIOA, self)
+                     for i in range(8)]
 
-        self.relays = [pifacecommon.mcp23s17.MCP23S17RegisterBit(
-            i, pifacecommon.mcp23s17.GPIOA, self)
-            for i in range(2)]
+        self.relays = [OutputPin(i, pifacecommon.mcp23s17.GPIOA, self)
+                       for i in range(2)]
 
         self.switches = [pifacecommon.mcp23s17.MCP23S17RegisterBitNeg(
             i, pifacecommon.mcp23s17.GPIOB, self)
             for i in range(4)]
 
         if init_board:
-            self.init_board()
+            try:
+                if attach:
+                    self.attach_board()
+                else:
+                    self.init_board()
+            except NoPiFaceDigitalDetectedError:
+                self.close_fd()  # don't leak the fd of a missing board
+                raise
+
+    def open_fd(self, spi_device):
+        if self.backend is None:
+            super(PiFaceDigital, self).open_fd(spi_device)
+        else:
+            self.fd = None
+
+    def close_fd(self):
+        if self.backend is None:
+            super(PiFaceDigital, self).close_fd()
+        else:
+            del self.fd
+
+    def spisend(self, bytes_to_send):
+        """Sends bytes via the SPI bus at spi_speed_hz.
+
+        :param bytes_to_send: The bytes to send on the SPI device.
+        :type bytes_to_send: bytes
+        :returns: bytes -- returned bytes from SPI device
+        """
+        if self.backend is not None:
+            return self.backend.spisend(bytes_to_send)
+        wbuffer = ctypes.create_string_buffer(bytes_to_send,
+                                              len(bytes_to_send))
+        rbuffer = ctypes.create_string_buffer(len(bytes_to_send))
+        transfer = spi_ioc_transfer(
+            tx_buf=ctypes.addressof(wbuffer),
+            rx_buf=ctypes.addressof(rbuffer),
+            len=ctypes.sizeof(wbuffer),
+            speed_hz=self.spi_speed_hz  # 0 is the driver's default
+        )
+        if self.spi_callback is not None:
+            self.spi_callback(bytes_to_send)
+        try:
+            ioctl(self.fd, SPI_IOC_MESSAGE(1), transfer)
+        except IOError:
+            self.spi_errors += 1
+            raise
+        return ctypes.string_at(rbuffer, ctypes.sizeof(rbuffer))
+
+    def autotune_spi_speed(self, speeds=SPI_SPEEDS_HZ, margin=0.8,
+                           attempts=64, save=True):
+        """Finds the fastest SPI clock speed this board works reliably at.
+        Each speed is tried in turn (slowest first) by writing patterns to
+        DEFVALA, reading them back and reading back IOCON, as
+        :meth:`init_board` does. The fastest speed that works, less the
+        safety margin, is used from then on and remembered in
+        :data:`SPI_SPEED_CACHE_FILE` for future PiFaceDigital objects.
+        Speeds above :data:`MAX_SPI_SPEED_HZ` are not tried.
+
+        Both ports are locked while tuning. A transfer garbled at a speed
+        which failed could have written any register, so afterwards the
+        configuration and the output port are checked at the chosen speed
+        and written again if they have changed.
+
+        :param speeds: Speeds to try in Hz (default: SPI_SPEEDS_HZ).
+        :type speeds: list
+        :param margin: Use the fastest listed speed below the fastest
+            working speed times margin (default: 0.8).
+        :type margin: float
+        :param attempts: Patterns checked at each speed (default: 64).
+        :type attempts: int
+        :param save: Remember the speed for future runs (default: True).
+        :type save: boolean
+        :returns: int -- the chosen speed in Hz
+        :raises: :class:`NoPiFaceDigitalDetectedError`
+        """
+        speeds = sorted(speed for speed in speeds
+                        if speed <= MAX_SPI_SPEED_HZ)
+        if len(speeds) == 0:
+            raise ValueError("No SPI speeds up to {} Hz to try.".format(
+                MAX_SPI_SPEED_HZ))
+        with self._port_locks[0]:
+            with self._port_locks[1]:
+                self._autotune_spi_speed(speeds, margin, attempts)
+        if save:
+            spi_speeds = _load_spi_speeds()
+            spi_speeds[_spi_speed_key(self)] = self.spi_speed_hz
+            _save_spi_speeds(spi_speeds)
+        return self.spi_speed_hz
+
+    def _autotune_spi_speed(self, speeds, margin, attempts):
+        original_speed = self.spi_speed_hz
+        # DEFVALA is only used by port A interrupts, which are always off
+        self.spi_speed_hz = speeds[0]
+        original_defvala = self.defvala.value
+        working_speeds = list()
+        for speed in speeds:
+            self.spi_speed_hz = speed
+            if not self._spi_speed_works(attempts):
+                break
+            working_speeds.append(speed)
+
+        self.spi_speed_hz = speeds[0]
+        self.defvala.value = original_defvala
+        if len(working_speeds) == 0:
+            self.spi_speed_hz = original_speed
+            raise NoPiFaceDigitalDetectedError(
+                "No PiFace Digital board detected (hardware_addr={h}, "
+                "bus={b}, chip_select={c}).".format(
+                    h=self.hardware_addr, b=self.bus, c=self.chip_select))
+
+        safe_speeds = [speed for speed in working_speeds
+                       if speed <= working_speeds[-1] * margin]
+        self.spi_speed_hz = max(safe_speeds or working_speeds[:1])
+
+        if self._config is not None and self._config != self.read_registers(
+                pifacecommon.mcp23s17.IODIRA, CONFIG_REGISTERS):
+            self._restore_config()
+        if self._output_latch is not None and \
+                self.olata.value != self._output_latch:
+            self.write(self._output_latch, pifacecommon.mcp23s17.GPIOA)
+
+    def _spi_speed_works(self, attempts):
+        for i in range(attempts):
+            pattern = (0x55, 0xAA, 0x00, 0xFF, i & 0xFF)[i % 5]
+            self.defvala.value = pattern
+            if self.defvala.value != pattern:
+                return False
+        return self.iocon.value == IOCON_CONFIG
+
+    def read_registers(self, address, count):
+        """Returns count consecutive registers starting at address, read in
+        one SPI transaction. Relies on IOCON.SEQOP set by
+        :meth:`init_board`.
+
+        :param address: The first register to read.
+        :type address: int
+        :param count: The number of registers to read.
+        :type count: int
+        :returns: bytearray -- the register values
+        """
+        ctrl_byte = self._get_spi_control_byte(pifacecommon.mcp23s17.READ_CMD)
+        data = self.spisend(bytes(bytearray([ctrl_byte, address] +
+                                            [0] * count)))
+        return bytearray(data)[2:]
+
+    def write_registers(self, address, values):
+        """Writes values to consecutive registers starting at address in
+        one SPI transaction. Relies on IOCON.SEQOP set by
+        :meth:`init_board`.
+
+        :param address: The first register to write.
+        :type address: int
+        :param values: The register values.
+        :type values: list
+        """
+        ctrl_byte = self._get_spi_control_byte(
+            pifacecommon.mcp23s17.WRITE_CMD)
+        self.spisend(bytes(bytearray([ctrl_byte, address] + list(values))))
+        if address < CONFIG_REGISTERS:
+            self._cache_config(address, values)
+
+    def config_register(self, address):
+        """Returns the value of a configuration register (IODIRA to GPPUB)
+        from memory, without an SPI transaction. They are all read in one
+        burst the first time if the board was not set up by
+        :meth:`init_board` or :meth:`attach_board`.
+
+        >>> bin(pfd.config_register(pifacecommon.mcp23s17.GPPUB))
+        '0b11111111'
+
+        :param address: The register.
+        :type address: int
+        :returns: int -- the register value
+        """
+        if self._config is None:
+            with self._port_locks[0]:
+                with self._port_locks[1]:
+                    self._config = self.read_registers(
+                        pifacecommon.mcp23s17.IODIRA, CONFIG_REGISTERS)
+        return self._config[address]
+
+    def configure(self, pullups=None, interrupts=None, compare=None,
+                  normal=None):
+        """Configures the input pins. Only the registers which change are
+        written, in one SPI transaction, and arguments left as None are not
+        changed.
+
+        >>> pfd.configure(pullups=0x0F, interrupts=0b0011)
+
+        :param pullups: The input pins with pullups on (GPPUB).
+        :type pullups: int
+        :param interrupts: The input pins which interrupt (GPINTENB).
+        :type interrupts: int
+        :param compare: The input pins which interrupt whenever they differ
+            from normal instead of whenever they change (INTCONB).
+        :type compare: int
+        :param normal: The values the compare pins are compared with, as
+            read from input_port (DEFVALB).
+        :type normal: int
+        """
+        config = dict()
+        if pullups is not None:
+            config[pifacecommon.mcp23s17.GPPUB] = pullups & 0xFF
+        if interrupts is not None:
+            config[pifacecommon.mcp23s17.GPINTENB] = interrupts & 0xFF
+        if compare is not None:
+            config[pifacecommon.mcp23s17.INTCONB] = compare & 0xFF
+        if normal is not None:
+            # inputs are pulled up, so compare with the inverted level
+            config[pifacecommon.mcp23s17.DEFVALB] = 0xFF ^ normal & 0xFF
+        self._write_config(config)
+
+    def _write_config(self, config):
+        """Writes the registers in config ({address: value}) which differ
+        from the cached values. The registers between the first and last
+        changed are rewritten with their cached values so that one burst
+        does it.
+        """
+        with self._port_locks[0]:
+            with self._port_locks[1]:
+                changed = [address for address, value in config.items()
+                           if self.config_register(address) != value]
+                if not changed:
+                    return
+                first, last = min(changed), max(changed)
+                values = self._config[first:last + 1]
+                for address in changed:
+                    values[address - first] = config[address]
+                self.write_registers(first, values)
+
+    def check_config(self):
+        """Checks that the board still has its configuration with one burst
+        read. A board which has browned out or been unplugged and plugged
+        back in is back to its power on configuration and raises no
+        interrupts. If so the configuration and the output port are written
+        again, as they were before, and :attr:`resets` is counted.
+
+        :returns: bytearray -- the configuration registers as they were
+            read if the board had been reset, otherwise None
+        :raises: :class:`NoPiFaceDigitalDetectedError`
+        """
+        if self._config is None:
+            return None  # never set up, so nothing to put back
+        iodira = pifacecommon.mcp23s17.IODIRA
+        with self._port_locks[0]:
+            with self._port_locks[1]:
+                registers = self.read_registers(iodira, CONFIG_REGISTERS)
+                if registers == self._config or not self._restore_config():
+                    return None
+                self.resets += 1
+                return registers
+
+    def _restore_config(self):
+        """Writes IOCON, the output latch and the configuration registers
+        from memory. Returns False, having only written IOCON, if that was
+        all it took (another board without IOCON.HAEN answered as well).
+        Hold both port locks.
+        """
+        iodira = pifacecommon.mcp23s17.IODIRA
+        config = bytearray(self._config)
+        self.iocon.value = IOCON_CONFIG
+        if self.iocon.value != IOCON_CONFIG:
+            raise NoPiFaceDigitalDetectedError(
+                "No PiFace Digital board detected (hardware_addr={h}, "
+                "bus={b}, chip_select={c}).".format(
+                    h=self.hardware_addr, b=self.bus, c=self.chip_select))
+        if self.read_registers(iodira, CONFIG_REGISTERS) == config:
+            return False
+        if self._output_latch is not None:
+            # set the latch while GPIOA is still an input
+            self.gpioa.value = self._output_latch
+        # interrupts last, as in init_board
+        interrupts = config[pifacecommon.mcp23s17.GPINTENB]
+        config[pifacecommon.mcp23s17.GPINTENB] = 0
+        self.write_registers(iodira, config)
+        self.write(interrupts, pifacecommon.mcp23s17.GPINTENB)
+        return True
+
+    def _cache_config(self, address, values):
+        if self._config is None:
+            return  # filled in by config_register
+        for register, value in enumerate(values, address):
+            if register >= CONFIG_REGISTERS:
+                break
+            if register in (pifacecommon.mcp23s17.IOCON,
+                            pifacecommon.mcp23s17.IOCON + 1):
+                # one register at two addresses
+                self._config[pifacecommon.mcp23s17.IOCON] = value
+                self._config[pifacecommon.mcp23s17.IOCON + 1] = value
+            else:
+                self._config[register] = value
+        if address <= pifacecommon.mcp23s17.GPPUB < address + len(values):
+            self._state_changed()
+
+    def port_lock(self, address):
+        """Returns the lock guarding the port that address belongs to.
+        Hold it to make several transactions on that port atomic.
+
+        >>> with pfd.port_lock(pifacecommon.mcp23s17.GPIOA):
+        ...     if pfd.output_pins[0].value:
+        ...         pfd.output_pins[1].turn_on()
+
+        :param address: A register address on the port.
+        :type address: int
+        """
+        return self._port_locks[address & 1]
+
+    def write(self, data, address):
+        with self._port_locks[address & 1]:
+            super(PiFaceDigital, self).write(data, address)
+            if address < CONFIG_REGISTERS:
+                self._cache_config(address, (data,))
+            elif address in (pifacecommon.mcp23s17.GPIOA,
+                           pifacecommon.mcp23s17.OLATA):
+                self._output_latch = data
+                publisher = self._state_publisher
+                if publisher is not None:
+                    publisher.publish_outputs(data, _monotonic_ns())
+                self._state_changed()
+
+    def write_bit(self, value, bit_num, address):
+        with self._port_locks[address & 1]:
+            super(PiFaceDigital, self).write_bit(value, bit_num, address)
+
+    def set_bits(self, mask, address=pifacecommon.mcp23s17.GPIOA):
+        """Sets the bits in mask high as one locked transaction.
+
+        :param mask: The bits to set.
+        :type mask: int
+        :param address: The register to change (default: GPIOA).
+        :type address: int
+        :returns: int -- the new register value
+        """
+        with self._port_locks[address & 1]:
+            value = self.read(address) | mask
+            self.write(value, address)
+        return value
+
+    def clear_bits(self, mask, address=pifacecommon.mcp23s17.GPIOA):
+        """Sets the bits in mask low as one locked transaction.
+
+        :param mask: The bits to clear.
+        :type mask: int
+        :param address: The register to change (default: GPIOA).
+        :type address: int
+        :returns: int -- the new register value
+        """
+        with self._port_locks[address & 1]:
+            value = self.read(address) & ~mask & 0xFF
+            self.write(value, address)
+        return value
+
+    def toggle_bits(self, mask, address=pifacecommon.mcp23s17.GPIOA):
+        """Toggles the bits in mask as one locked transaction.
+
+        :param mask: The bits to toggle.
+        :type mask: int
+        :param address: The register to change (default: GPIOA).
+        :type address: int
+        :returns: int -- the new register value
+        """
+        with self._port_locks[address & 1]:
+            value = self.read(address) ^ mask
+            self.write(value, address)
+        return value
+
+    def pulse_mask(self, mask, duration):
+        """Turns the mask output pins on for duration seconds without
+        blocking. The pins are turned off by the process's
+        :class:`pifacedigitalio.timerwheel.TimerWheel` thread, to within a
+        millisecond. Pulsing a pin which is already pulsing restarts its
+        pulse.
+
+        >>> pulse = pfd.pulse_mask(0b11, 2)  # both relays for two seconds
+        >>> pulse.cancel()
+
+        :param mask: The output pins to pulse.
+        :type mask: int
+        :param duration: Seconds to stay on.
+        :type duration: float
+        :returns: :class:`pifacedigitalio.timerwheel.Pulse`
+        """
+        return timer_wheel().pulse(self, mask, duration)
+
+    @property
+    def rules(self):
+        """The rules set with :meth:`set_rules`."""
+        if self._rule_table is None:
+            return tuple()
+        else:
+            return self._rule_table.rules
+
+    def set_rules(self, rules,
+                  settle_time=pifacecommon.interrupts.DEFAULT_SETTLE_TIME):
+        """Drives the outputs straight from the inputs using the rules in
+        :mod:`pifacedigitalio.rules`. The rules are compiled into lookup
+        tables and run by an active :class:`InputEventListener` as soon as
+        each interrupt is decoded, before any callbacks. Replaces the
+        current rules, even while the listener is running.
+
+        >>> from pifacedigitalio.rules import Follow, Latch
+        >>> pfd.set_rules([Follow(0, 0), Latch(1, set_pin=1, reset_pin=2)])
+
+        :param rules: The rules.
+        :type rules: list
+        :param settle_time: Edges on an input closer together than this are
+            ignored by edge triggered rules.
+        :type settle_time: float
+        """
+        rule_table = RuleTable(rules, settle_time)
+        inputs = self.input_port.value
+        rule_table.last_inputs = inputs
+        self._rule_table = rule_table
+        self._update_interrupt_enable()
+        self._run_rules(inputs, time.time())
+
+    def clear_rules(self):
+        """Removes the rules set with :meth:`set_rules`. The outputs keep
+        their current values.
+        """
+        self._rule_table = None
+        self._update_interrupt_enable()
+
+    def _run_rules(self, inputs, timestamp):
+        rule_table = self._rule_table
+        if rule_table is None:
+            return
+        with self._port_locks[0]:
+            if self._output_latch is None:
+                self._output_latch = self.gpioa.value
+            outputs = rule_table.run(self._output_latch, inputs, timestamp)
+            if outputs != self._output_latch:
+                self.write(outputs, pifacecommon.mcp23s17.GPIOA)
+
+    def publish_state(self, path=None):
+        """Publishes the inputs and outputs of this board in shared memory
+        for :class:`pifacedigitalio.mirror.PiFaceDigitalMirror` to read in
+        other processes. Outputs are published as they are written and
+        inputs by an active :class:`InputEventListener` as each interrupt
+        is decoded.
+
+        :param path: The shared memory file (default:
+            /dev/shm/pifacedigitalio-<bus>.<chip_select>.<hardware_addr>).
+        :type path: string
+        :returns: :class:`pifacedigitalio.mirror.StatePublisher`
+        """
+        if path is None:
+            path = mirror_path(self.hardware_addr, self.bus, self.chip_select)
+        with self._port_locks[0]:
+            if self._output_latch is None:
+                self._output_latch = self.gpioa.value
+            self._state_publisher = StatePublisher(
+                path, self.input_port.value, self._output_latch)
+        self._update_interrupt_enable()
+        return self._state_publisher
+
+    def _open_interrupt_line(self):
+        """Returns the file which becomes readable when the interrupt line
+        falls.
+        """
+        if self.backend is None:
+            return open(pifacecommon.interrupts.GPIO_INTERRUPT_DEVICE_VALUE)
+        else:
+            return self.backend.open_interrupt_line()
+
+    def gpio_interrupts_enable(self):
+        if self.backend is None:
+            super(PiFaceDigital, self).gpio_interrupts_enable()
+
+    def gpio_interrupts_disable(self):
+        if self.backend is None:
+            super(PiFaceDigital, self).gpio_interrupts_disable()
 
     def enable_interrupts(self):
-        self.gpintenb.value = 0xFF  # enable interrupts
+        self.configure(interrupts=0xFF)
         self.gpio_interrupts_enable()
 
     def disable_interrupts(self):
-        self.gpintenb.value = 0x00
+        self.configure(interrupts=0x00)
         self.gpio_interrupts_disable()
 
+    def set_interrupt_compare(self, mask, normal=0):
+        """Makes the mask input pins interrupt whenever they differ from
+        normal instead of whenever they change (INTCONB and DEFVALB), for
+        alarm inputs which matter while they are on rather than when they
+        change. The other inputs interrupt on change.
+
+        >>> pfd.set_interrupt_compare(0b1000)  # alarm while input 3 is on
+
+        :param mask: The input pins to compare.
+        :type mask: int
+        :param normal: The values the pins are compared with, as read from
+            input_port (default: 0).
+        :type normal: int
+        """
+        self.configure(compare=mask, normal=normal)
+
+    def _update_interrupt_enable(self):
+        """Enables interrupts on only the inputs needed by the active
+        :class:`InputEventListener`, the rules and the published state, so
+        that other inputs can't wake the detector.
+        """
+        if self._listener_pins is None:
+            return  # left as configured while nothing is listening
+        pins = self._listener_pins
+        if self._rule_table is not None:
+            pins |= self._rule_table.input_mask
+        if self._state_publisher is not None:
+            pins = 0xFF
+        self.configure(interrupts=pins)
+
+    def wait_for_change(self, mask=0xFF, timeout=None):
+        """Blocks the calling thread until one of the input pins in mask
+        changes. Sleeps on the interrupt line instead of polling the input
+        port so no CPU or SPI bandwidth is used while waiting. Interrupts
+        must be enabled (see :meth:`enable_interrupts`).
+
+        .. note:: Do not use this on a board which also has an active
+           :class:`InputEventListener`; only one of them will see each
+           interrupt.
+
+        >>> pfd.wait_for_change(mask=0b0100, timeout=10)
+        4
+
+        :param mask: The input pins to wait for (default: 0xFF).
+        :type mask: int
+        :param timeout: Maximum seconds to wait, None waits forever
+            (default: None).
+        :type timeout: float
+        :returns: int -- the pins in mask that changed, 0 on timeout
+        """
+        interrupt = self._wait_for_interrupt(mask, timeout)
+        return 0 if interrupt is None else interrupt[0]
+
+    def wait_for_value(self, pin_num, value, timeout=None):
+        """Blocks the calling thread until the input pin reads value.
+        Returns straight away if it already does. See
+        :meth:`wait_for_change`.
+
+        >>> pfd.wait_for_value(2, 1)  # wait until switch 2 is pressed
+        True
+
+        :param pin_num: The input pin to wait for.
+        :type pin_num: int
+        :param value: The value to wait for.
+        :type value: int
+        :param timeout: Maximum seconds to wait, None waits forever
+            (default: None).
+        :type timeout: float
+        :returns: boolean -- False if timed out
+        """
+        def pin_has_value(capture):
+            if capture is None:
+                return self.input_pins[pin_num].value == value
+            else:
+                # inputs are pulled up, so a captured 0 is logical 1
+                return (1 ^ (capture >> pin_num) & 1) == value
+
+        interrupt = self._wait_for_interrupt(1 << pin_num,
+                                             timeout,
+                                             pin_has_value)
+        return interrupt is not None
+
+    def _wait_for_interrupt(self, mask, timeout, done=None):
+        """Waits on the interrupt line until an input pin in mask changes
+        and done(interrupt_capture) is true. done(None) is checked once
+        before blocking, after stale interrupts have been cleared.
+        Returns (interrupt_flag & mask, interrupt_capture), (0, None) if
+        done(None) was true or None if timed out.
+        """
+        if timeout is not None:
+            deadline = _monotonic() + timeout
+        line = self._open_interrupt_line()
+        epoll = select.epoll()
+        try:
+            epoll.register(line, select.EPOLLIN | select.EPOLLET)
+            # the line only interrupts on an edge, so clear what is pending
+            self.clear_interrupts(pifacecommon.mcp23s17.GPIOB)
+            if done is not None and done(None):
+                return 0, None
+            while True:
+                if timeout is None:
+                    wait = -1
+                else:
+                    wait = deadline - _monotonic()
+                    if wait <= 0:
+                        return None
+                try:
+                    if len(epoll.poll(wait)) == 0:
+                        continue
+                except IOError as e:
+                    if e.errno != errno.EINTR:
+                        raise
+                    continue
+                interrupt_flag = self.intfb.value
+                if interrupt_flag == 0:
+                    continue  # another board or the initial sysfs event
+                interrupt_capture = self.intcapb.value  # clears interrupt
+                interrupt_flag &= mask
+                if interrupt_flag != 0 and (
+                        done is None or done(interrupt_capture)):
+                    return interrupt_flag, interrupt_capture
+        finally:
+            epoll.close()
+            line.close()
+
     def init_board(self):
-        ioconfig = (
-            pifacecommon.mcp23s17.BANK_OFF |
-            pifacecommon.mcp23s17.INT_MIRROR_OFF |
-            pifacecommon.mcp23s17.SEQOP_OFF |
-            pifacecommon.mcp23s17.DISSLW_OFF |
-            pifacecommon.mcp23s17.HAEN_ON |
-            pifacecommon.mcp23s17.ODR_OFF |
-            pifacecommon.mcp23s17.INTPOL_LOW
-        )
-        self.iocon.value = ioconfig
-        if self.iocon.value != ioconfig:
+        self.iocon.value = IOCON_CONFIG
+        if self.iocon.value != IOCON_CONFIG:
             raise NoPiFaceDigitalDetectedError(
                 "No PiFace Digital board detected (hardware_addr={h}, "
                 "bus={b}, chip_select={c}).".format(
                     h=self.hardware_addr, b=self.bus, c=self.chip_select))
         else:
-            # finish configuring the board
+            # finish configuring the board, every configuration register
+            # in one burst
             self.gpioa.value = 0
-            self.iodira.value = 0  # GPIOA as outputs
-            self.iodirb.value = 0xFF  # GPIOB as inputs
-            self.gppub.value = 0xFF  # input pullups on
+            config = bytearray(CONFIG_REGISTERS)  # power on values
+            config[pifacecommon.mcp23s17.IOCON] = IOCON_CONFIG
+            config[pifacecommon.mcp23s17.IOCON + 1] = IOCON_CONFIG
+            for address, value in BOARD_CONFIG.items():
+                config[address] = value
+            # GPINTENB comes before GPPUB, so interrupts go on afterwards
+            # or the pullups turning on would interrupt
+            config[pifacecommon.mcp23s17.GPINTENB] = 0
+            self._config = bytearray(config)
+            self.write_registers(pifacecommon.mcp23s17.IODIRA, config)
             self.enable_interrupts()
 
+    def attach_board(self):
+        """Sets up the board like :meth:`init_board`, but without glitching
+        the outputs. The configuration is checked with one burst read and
+        only the registers which differ are written. The output port is
+        left alone unless the board has lost power, in which case the
+        outputs saved in state_file (if any) are restored.
+
+        :raises: :class:`NoPiFaceDigitalDetectedError`
+        """
+        state = self._load_state()
+        config = dict(BOARD_CONFIG)
+        if "gppub" in state:
+            config[pifacecommon.mcp23s17.GPPUB] = state["gppub"]
+
+        registers = self.read_registers(pifacecommon.mcp23s17.IODIRA,
+                                        pifacecommon.mcp23s17.GPPUB + 1)
+        lost_power = False
+        if registers[pifacecommon.mcp23s17.IOCON] != IOCON_CONFIG:
+            # unconfigured, or configured without sequential operation
+            iocon = self.iocon.value
+            lost_power = not iocon & pifacecommon.mcp23s17.HAEN_ON
+            self.iocon.value = IOCON_CONFIG
+            if self.iocon.value != IOCON_CONFIG:
+                raise NoPiFaceDigitalDetectedError(
+                    "No PiFace Digital board detected (hardware_addr={h}, "
+                    "bus={b}, chip_select={c}).".format(
+                        h=self.hardware_addr, b=self.bus,
+                        c=self.chip_select))
+            registers = self.read_registers(pifacecommon.mcp23s17.IODIRA,
+                                            pifacecommon.mcp23s17.GPPUB + 1)
+
+        if lost_power and "outputs" in state:
+            # set the latch while GPIOA is still an input
+            self.gpioa.value = state["outputs"]
+        self._config = registers
+        self._write_config(config)
+        self.gpio_interrupts_enable()
+
+    def save_state(self):
+        """Saves the outputs and pullups to state_file, to be restored by
+        :meth:`attach_board` if the board loses power. This is done
+        whenever they change, so a crash or power cut can't leave an old
+        state to be restored.
+        """
+        with self._state_lock:
+            outputs = self._output_latch
+            if outputs is None:
+                outputs = self.output_port.value
+            state = {"outputs": outputs,
+                     "gppub": self.config_register(
+                         pifacecommon.mcp23s17.GPPUB)}
+            if state == self._saved_state:
+                return
+            temp_file = self.state_file + ".tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(state, f)
+            os.rename(temp_file, self.state_file)  # atomic
+            self._saved_state = state
+
+    def _state_changed(self):
+        # only once set up, so that nothing here needs the port locks
+        if self.state_file is not None and self._config is not None and \
+                self._output_latch is not None:
+            self.save_state()
+
+    def _load_state(self):
+        if self.state_file is None:
+            return dict()
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
     def deinit_board(self):
-        if self.gpintenb.value != 0x00:  # probably should be a function
-            self.disable_interrupts()
+        if self.state_file is not None:
+            self.save_state()
+        # stop publishing before closing, other threads may be mid-change
+        publisher, self._state_publisher = self._state_publisher, None
+        if publisher is not None:
+            publisher.close()
+        self.disable_interrupts()
         self.close_fd()
 
 
+class InputEvent(pifacecommon.interrupts.InterruptEvent):
+    """An input port interrupt, timed when the detector woke on the
+    interrupt line.
+
+    ``timestamp_ns`` is ``time.monotonic_ns()`` at wake, so the time
+    between two events is exact however long they waited to be dispatched::
+
+        >>> def reaction_time(event):
+        ...     print((event.timestamp_ns - shown_ns) / 1e6, "ms")
+
+    ``dispatch_time_ns`` is when the dispatcher took the event off the queue
+    (None until then) and :attr:`dispatch_delay_ns` is the time between.
+    """
+    def __init__(self, interrupt_flag, interrupt_capture, chip, timestamp,
+                 timestamp_ns):
+        super(InputEvent, self).__init__(
+            interrupt_flag, interrupt_capture, chip, timestamp)
+        self.timestamp_ns = timestamp_ns
+        self.dispatch_time_ns = None
+
+    @property
+    def dispatch_delay_ns(self):
+        """Nanoseconds from the interrupt to dispatch."""
+        if self.dispatch_time_ns is None:
+            return None
+        return self.dispatch_time_ns - self.timestamp_ns
+
+
+class PortEvent(object):
+    """A change on the input port, delivered to callbacks registered with
+    :meth:`InputEventListener.register_port`.
+
+    :attribute: chip -- the :class:`PiFaceDigital`.
+    :attribute: previous -- the input port value at the last event.
+    :attribute: value -- the input port value now.
+    :attribute: changed -- the registered pins which differ.
+    :attribute: timestamp -- ``time.time()`` at the latest interrupt.
+    :attribute: timestamp_ns -- ``time.monotonic_ns()`` at the latest
+        interrupt.
+    """
+    def __init__(self, chip, previous, value, changed, timestamp,
+                 timestamp_ns):
+        self.chip = chip
+        self.previous = previous
+        self.value = value
+        self.changed = changed
+        self.timestamp = timestamp
+        self.timestamp_ns = timestamp_ns
+
+
+class PortFunctionMap(pifacecommon.interrupts.FunctionMap):
+    """Maps changes on the masked input pins to a callback function,
+    merging changes within window seconds of the first.
+    """
+    def __init__(self, callback, mask, window, value):
+        super(PortFunctionMap, self).__init__(callback)
+        self.mask = mask
+        self.window_ns = int(window * 1e9)
+        # the input port at the last callback, None until the first change
+        self.value = value
+        self.latest = None  # the newest change not yet delivered
+        self.due_ns = None
+
+    def add(self, port_event):
+        """Returns the :class:`PortEvent` to call back with now, if any."""
+        if self.value is None:
+            # the pins the interrupt flagged are the ones that changed
+            self.value = port_event.value ^ port_event.changed
+        if self.latest is None and \
+                not (port_event.value ^ self.value) & self.mask:
+            return None
+        self.latest = port_event
+        if self.window_ns == 0:
+            return self.deliver()
+        elif self.due_ns is None:
+            self.due_ns = port_event.timestamp_ns + self.window_ns
+        return None
+
+    def deliver(self):
+        """Ends the merge window. Returns the :class:`PortEvent` to call
+        back with, if any.
+        """
+        latest = self.latest
+        self.latest = self.due_ns = None
+        changed = (latest.value ^ self.value) & self.mask
+        if not changed:  # pins can change back within the window
+            return None
+        port_event = PortEvent(latest.chip, self.value, latest.value,
+                               changed, latest.timestamp, latest.timestamp_ns)
+        self.value = latest.value
+        return port_event
+
+
+class EventQueue(pifacecommon.interrupts.EventQueue):
+    """Stores events in a queue between the detector and dispatcher
+    threads. With a maxsize, events arriving while the queue is full are
+    handled by the overflow policy:
+
+    - OVERFLOW_DROP_OLDEST: the oldest queued event is dropped.
+    - OVERFLOW_DROP_NEWEST: the new event is dropped.
+    - OVERFLOW_COALESCE: the new event replaces a queued event for the same
+      pin (or the queued port change), so the latest state is delivered.
+      The oldest event is dropped if there is none.
+    - OVERFLOW_BLOCK: the detector waits until there is room (or the
+      queue is closed). Changes are held in the chip's interrupt registers
+      meanwhile.
+
+    Only events are dropped, never signals such as TERMINATE_SIGNAL.
+
+    :attribute: depth -- events in the queue.
+    :attribute: high_water -- the most events there have been in the queue.
+    :attribute: dropped -- events dropped.
+    :attribute: coalesced -- events replaced by later ones.
+    :attribute: interrupts -- interrupts decoded by the detector.
+    :attribute: inputs -- the input port at the last interrupt (None until
+        then).
+    :attribute: edges -- interrupts flagged on each input pin.
+    :attribute: dispatched -- events taken off the queue by the dispatcher.
+    :attribute: dispatch_delay_total_ns -- the sum of their
+        :attr:`InputEvent.dispatch_delay_ns`.
+    """
+    def __init__(self, pin_function_maps, port_function_maps=None,
+                 maxsize=0, overflow=OVERFLOW_DROP_OLDEST):
+        self.last_event_time = [0]*8  # last event time on each pin
+        self.pin_function_maps = pin_function_maps
+        if port_function_maps is None:
+            port_function_maps = list()
+        self.port_function_maps = port_function_maps
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.events = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.high_water = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.interrupts = 0
+        self.inputs = None
+        self.edges = [0] * 8
+        self.dispatched = 0
+        self.dispatch_delay_total_ns = 0
+
+    @property
+    def depth(self):
+        return len(self.events)
+
+    def add_event(self, event):
+        # inputs are pulled up, so invert the capture
+        inputs = 0xFF ^ event.interrupt_capture
+        self.interrupts += 1
+        self.inputs = inputs
+        for pin_num in range(8):
+            if event.interrupt_flag & (1 << pin_num):
+                self.edges[pin_num] += 1
+        super(EventQueue, self).add_event(event)
+        if self.port_function_maps:
+            self.put(PortEvent(event.chip, None, inputs,
+                               event.interrupt_flag, event.timestamp,
+                               event.timestamp_ns))
+
+    def put(self, thing):
+        with self.condition:
+            # signals such as TERMINATE_SIGNAL are never dropped
+            if self.maxsize and len(self.events) >= self.maxsize and \
+                    _is_event(thing):
+                if not self._make_room(thing):
+                    return
+            self.events.append(thing)
+            if len(self.events) > self.high_water:
+                self.high_water = len(self.events)
+            self.condition.notify_all()
+
+    def _make_room(self, event):
+        """Applies the overflow policy to the full queue. Returns True if
+        event should be queued.
+        """
+        if self.overflow == OVERFLOW_BLOCK:
+            while len(self.events) >= self.maxsize and not self.closed:
+                self.condition.wait()
+            if not self.closed:
+                return True
+            self.dropped += 1  # nothing will take it off the queue
+            return False
+        elif self.overflow == OVERFLOW_DROP_NEWEST:
+            self.dropped += 1
+            return False
+        elif self.overflow == OVERFLOW_COALESCE:
+            for i, queued in enumerate(self.events):
+                if _same_source(queued, event):
+                    self.events[i] = event
+                    self.coalesced += 1
+                    return False
+        for i, queued in enumerate(self.events):
+            if _is_event(queued):
+                del self.events[i]
+                self.dropped += 1
+                break
+        return True
+
+    def close(self):
+        """Wakes a detector waiting for room, once the dispatcher has
+        stopped. Events put from then on are dropped.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """Returns the next event, waiting for at most timeout seconds.
+
+        :raises: queue.Empty if timed out
+        """
+        with self.condition:
+            if timeout is not None:
+                deadline = _monotonic() + timeout
+            while not self.events:
+                if timeout is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - _monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self.condition.wait(remaining)
+            thing = self.events.popleft()
+            self.condition.notify_all()  # there is room for the detector
+        if isinstance(thing, InputEvent):
+            thing.dispatch_time_ns = _monotonic_ns()
+            self.dispatched += 1
+            self.dispatch_delay_total_ns += thing.dispatch_delay_ns
+        return thing
+
+
+def _is_event(thing):
+    return isinstance(thing, (InputEvent, PortEvent))
+
+
+def _same_source(event, other_event):
+    if isinstance(event, PortEvent):
+        return isinstance(other_event, PortEvent)
+    return isinstance(other_event, InputEvent) and \
+        event.pin_num == other_event.pin_num
+
+
+class CallbackStats(object):
+    """How long a callback function has taken.
+
+    :attribute: calls -- the number of calls.
+    :attribute: total_ns -- nanoseconds spent in all calls.
+    :attribute: max_ns -- nanoseconds spent in the longest call.
+    :attribute: slow_calls -- calls longer than the listener's
+        slow_callback_time.
+    :attribute: errors -- calls which raised an exception (logged).
+    """
+    def __init__(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.slow_calls = 0
+        self.errors = 0
+
+    @property
+    def mean_ns(self):
+        return self.total_ns // self.calls if self.calls else 0
+
+
+class SlowCallbackWarning(UserWarning):
+    pass
+
+
+class CallbackWorkers(object):
+    """Runs callbacks on a pool of threads. Callbacks with the same key
+    always run on the same thread, so they run in order.
+    """
+    def __init__(self, threads, run_callback, daemon=False):
+        self.run_callback = run_callback
+        self.queues = [queue.Queue() for i in range(threads)]
+        self.threads = [threading.Thread(target=self._work, args=(q,))
+                        for q in self.queues]
+        for thread in self.threads:
+            thread.daemon = daemon
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Waits for the queued callbacks to finish."""
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def submit(self, callback, event, key):
+        self.queues[key % len(self.queues)].put((callback, event, key))
+
+    def _work(self, q):
+        while True:
+            work = q.get()
+            if work is None:
+                return
+            self.run_callback(*work)
+
+
 class InputEventListener(pifacecommon.interrupts.PortEventListener):
     """Listens for events on the input port and calls the mapped callback
     functions.
@@ -129,47 +1254,387 @@ class InputEventListener(pifacecommon.interrupts.PortEventListener):
     >>> listener = pifacedigitalio.InputEventListener()
     >>> listener.register(0, pifacedigitalio.IODIR_ON, print_flag)
     >>> listener.activate()
+
+    The detector and dispatcher are both threads in this process, so
+    callbacks can be registered at any time and the chip's rules (see
+    :meth:`PiFaceDigital.set_rules`) share its port locks.
+
+    By default the queue of events waiting for callbacks can grow without
+    limit. Set max_queue_size to bound it, and overflow to choose what
+    happens to events when it is full (see :class:`EventQueue`)::
+
+        >>> listener = pifacedigitalio.InputEventListener(
+        ...     max_queue_size=16, overflow=pifacedigitalio.OVERFLOW_COALESCE)
+        >>> listener.event_queue.dropped
+        0
+
+    Callbacks run one at a time on the dispatcher thread unless
+    callback_threads is set, in which case they run on that many threads.
+    Callbacks for the same pin (and all port callbacks) still run in the
+    order their events happened, so only independent inputs run
+    concurrently. Each callback's time is kept in callback_stats, and
+    callbacks taking longer than slow_callback_time seconds raise a
+    :class:`SlowCallbackWarning`. Exceptions raised by callbacks are
+    logged and counted, and later events are still delivered::
+
+        >>> listener = pifacedigitalio.InputEventListener(
+        ...     callback_threads=4, slow_callback_time=0.1)
+        >>> listener.callback_stats[print_flag].max_ns
+        2000
     """
-    def __init__(self, chip=None, daemon=False):
+    def __init__(self, chip=None, daemon=False, max_queue_size=0,
+                 overflow=OVERFLOW_DROP_OLDEST, callback_threads=0,
+                 slow_callback_time=None):
         if chip is None:
             chip = PiFaceDigital()
-        # requires version bump to v4.0.0 becasue method signature has changed
-        # super(InputEventListener, self).__init__(pifacecommon.mcp23s17.GPIOB,
-        #                                          chip,
-        #                                          daemon=daemon)
-        # work around for now -- doesn't depend on new version of pifacecommon
-        super(InputEventListener, self).__init__(pifacecommon.mcp23s17.GPIOB,
-                                                 chip)
+        self.port = pifacecommon.mcp23s17.GPIOB
+        self.chip = chip
+        self.callback_stats = dict()
+        self._callback_stats_lock = threading.Lock()
+        self.slow_callback_time = slow_callback_time
+        if callback_threads:
+            self.workers = CallbackWorkers(callback_threads,
+                                           self._run_callback, daemon)
+            run_callback = self.workers.submit
+        else:
+            self.workers = None
+            run_callback = self._run_callback
+        self.pin_function_maps = list()
+        self.port_function_maps = list()
+        self.event_queue = EventQueue(self.pin_function_maps,
+                                      self.port_function_maps,
+                                      max_queue_size, overflow)
+        self._detector_stop, self._detector_stop_signal = os.pipe()
+        self.detector = threading.Thread(
+            target=watch_port_events,
+            args=(self.chip, self.event_queue, self._detector_stop))
+        self.dispatcher = threading.Thread(
+            target=handle_events,
+            args=(
+                self.pin_function_maps,
+                self.port_function_maps,
+                self.event_queue,
+                self.TERMINATE_SIGNAL,
+                run_callback))
         self.detector.daemon = daemon
         self.dispatcher.daemon = daemon
+        self.active = False
+
+    def register(self, pin_num, direction, callback,
+                 settle_time=pifacecommon.interrupts.DEFAULT_SETTLE_TIME):
+        """Registers a pin number and direction to a callback function.
+        Interrupts are only enabled on pins with callbacks (or needed by
+        the chip's rules or published state).
+
+        :param pin_num: The pin pin number.
+        :type pin_num: int
+        :param direction: The event direction
+            (use: IODIR_ON/IODIR_OFF/IODIR_BOTH)
+        :type direction: int
+        :param callback: The function to run when event is detected.
+        :type callback: function
+        :param settle_time: Time within which subsequent events are ignored.
+        :type settle_time: int
+        """
+        super(InputEventListener, self).register(
+            pin_num, direction, callback, settle_time)
+        self._update_interrupt_enable()
+
+    def deregister(self, pin_num, callback=None):
+        """Removes the callbacks registered to a pin.
+
+        :param pin_num: The pin number.
+        :type pin_num: int
+        :param callback: Only remove this callback (default: all of them).
+        :type callback: function
+        """
+        # the list is shared with the event queue and dispatcher
+        self.pin_function_maps[:] = [
+            function_map for function_map in self.pin_function_maps
+            if function_map.pin_num != pin_num or
+            (callback is not None and function_map.callback != callback)]
+        self._update_interrupt_enable()
+
+    def register_port(self, callback, mask=0xFF, window=0):
+        """Registers a callback for changes on several input pins at once.
+        It gets one :class:`PortEvent` however many of the pins changed,
+        and changes within window seconds of the first are merged into
+        that event.
+
+        >>> def selector_moved(event):
+        ...     print("position", event.value & 0x0F)
+        ...
+        >>> listener.register_port(selector_moved, mask=0x0F, window=0.01)
+
+        :param callback: The function to run when the pins change.
+        :type callback: function
+        :param mask: The input pins (default: 0xFF).
+        :type mask: int
+        :param window: Seconds over which to merge changes (default: 0).
+        :type window: float
+        """
+        if self.active:
+            # reading the port would clear an interrupt before the detector
+            # reads it, so start from the last one (or the next)
+            value = self.event_queue.inputs
+        else:
+            value = self.chip.input_port.value
+        self.port_function_maps.append(PortFunctionMap(
+            callback, mask, window, value))
+        self._update_interrupt_enable()
+
+    def deregister_port(self, callback):
+        """Removes a callback registered with :meth:`register_port`."""
+        self.port_function_maps[:] = [
+            function_map for function_map in self.port_function_maps
+            if function_map.callback != callback]
+        self._update_interrupt_enable()
+
+    def activate(self):
+        """When activated the :class:`InputEventListener` will run callbacks
+        associated with pins/directions.
+        """
+        self.active = True
+        self.event_queue.closed = False  # if deactivated before
+        self._update_interrupt_enable()
+        if self.workers is not None:
+            self.workers.start()
+        super(InputEventListener, self).activate()
+
+    def deactivate(self):
+        """When deactivated the :class:`InputEventListener` will not run
+        anything.
+        """
+        self.event_queue.put(self.TERMINATE_SIGNAL)
+        self.dispatcher.join()
+        self.event_queue.close()  # the detector may be waiting for room
+        if self.workers is not None:
+            self.workers.stop()
+        os.write(self._detector_stop_signal, b"\0")
+        self.detector.join()
+        os.close(self._detector_stop)
+        os.close(self._detector_stop_signal)
+        self.active = False
+        self.chip._listener_pins = None
+        self.chip.configure(
+            interrupts=BOARD_CONFIG[pifacecommon.mcp23s17.GPINTENB])
+
+    def _run_callback(self, callback, event, key):
+        start_ns = _monotonic_ns()
+        failed = False
+        try:
+            callback(event)
+        except Exception:
+            # keep the thread running the callbacks alive
+            failed = True
+            logger.exception("InputEventListener callback %s raised an "
+                             "exception.",
+                             getattr(callback, "__name__", callback))
+        finally:
+            duration_ns = _monotonic_ns() - start_ns
+            slow = self.slow_callback_time is not None and \
+                duration_ns > self.slow_callback_time * 1e9
+            with self._callback_stats_lock:
+                stats = self.callback_stats.get(callback)
+                if stats is None:
+                    stats = self.callback_stats[callback] = CallbackStats()
+                stats.calls += 1
+                stats.total_ns += duration_ns
+                stats.max_ns = max(stats.max_ns, duration_ns)
+                if slow:
+                    stats.slow_calls += 1
+                if failed:
+                    stats.errors += 1
+            if slow:
+                warnings.warn(
+                    "InputEventListener callback {} took longer than "
+                    "{}s.".format(getattr(callback, "__name__", callback),
+                                  self.slow_callback_time),
+                    SlowCallbackWarning)
+
+    def _update_interrupt_enable(self):
+        if self.active:
+            pins = 0
+            for function_map in self.pin_function_maps:
+                pins |= 1 << function_map.pin_num
+            for function_map in self.port_function_maps:
+                pins |= function_map.mask
+            self.chip._listener_pins = pins
+            self.chip._update_interrupt_enable()
+
+
+def watch_port_events(chip, event_queue, stop_fd):
+    """Waits for interrupts on the input port of chip. Runs the chip's rules
+    and puts an :class:`InputEvent` on the event queue for each one. Returns
+    once stop_fd is readable.
+
+    :param chip: The chip we are waiting for interrupts on.
+    :type chip: :class:`PiFaceDigital`
+    :param event_queue: A queue to put events on.
+    :type event_queue: :class:`EventQueue`
+    :param stop_fd: A file descriptor which becomes readable when the
+        detector should stop.
+    :type stop_fd: int
+    """
+    line = chip._open_interrupt_line()
+    epoll = select.epoll()
+    try:
+        epoll.register(line, select.EPOLLIN | select.EPOLLET)
+        epoll.register(stop_fd, select.EPOLLIN)
+        while True:
+            try:
+                events = epoll.poll()
+            except IOError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            # time the interrupt before spending any time on SPI
+            timestamp_ns = _monotonic_ns()
+            timestamp = time.time()
+            if any(fd == stop_fd for fd, event in events):
+                return
+
+            interrupt_flag = chip.intfb.value
+            if interrupt_flag == 0:
+                continue  # The interrupt has not been flagged on this board
+            interrupt_capture = chip.intcapb.value
+            # inputs are pulled up, so invert the capture
+            inputs = 0xFF ^ interrupt_capture
+            publisher = chip._state_publisher
+            if publisher is not None:
+                publisher.publish_inputs(inputs, timestamp_ns)
+            chip._run_rules(inputs, timestamp)
+            event_queue.add_event(InputEvent(
+                interrupt_flag, interrupt_capture, chip, timestamp,
+                timestamp_ns))
+    finally:
+        epoll.close()
+        line.close()
+
+
+def handle_events(pin_function_maps, port_function_maps, event_queue,
+                  terminate_signal, run_callback):
+    """Waits for events on the event queue and calls the registered
+    functions. Changes for port callbacks are held until their merge
+    window has passed.
+
+    :param pin_function_maps: :class:`pifacecommon.interrupts.PinFunctionMap`
+        s describing what to do with events.
+    :type pin_function_maps: list
+    :param port_function_maps: :class:`PortFunctionMap` s describing what to
+        do with port changes.
+    :type port_function_maps: list
+    :param event_queue: The queue events are put on.
+    :type event_queue: :class:`EventQueue`
+    :param terminate_signal: The signal that, when placed on the event queue,
+        causes this function to exit.
+    :param run_callback: Runs callback(event). Callbacks with the same
+        key (the pin number, or PORT_KEY) must run in order.
+    :type run_callback: function(callback, event, key)
+    """
+    while True:
+        due_ns = [function_map.due_ns for function_map in port_function_maps
+                  if function_map.due_ns is not None]
+        try:
+            if due_ns:
+                timeout = max(min(due_ns) - _monotonic_ns(), 0) / 1e9
+                event = event_queue.get(timeout=timeout)
+            else:
+                event = event_queue.get()
+        except queue.Empty:
+            event = None  # a merge window has passed
+        if event == terminate_signal:
+            return
+
+        # copy the lists, which callbacks may change
+        if isinstance(event, PortEvent):
+            for function_map in list(port_function_maps):
+                port_event = function_map.add(event)
+                if port_event is not None:
+                    run_callback(function_map.callback, port_event, PORT_KEY)
+        elif event is not None:
+            for function_map in list(pin_function_maps):
+                if pifacecommon.interrupts._event_matches_pin_function_map(
+                        event, function_map):
+                    run_callback(function_map.callback, event, event.pin_num)
+        if due_ns:
+            now_ns = _monotonic_ns()
+            for function_map in list(port_function_maps):
+                if function_map.due_ns is not None and \
+                        function_map.due_ns <= now_ns:
+                    port_event = function_map.deliver()
+                    if port_event is not None:
+                        run_callback(function_map.callback, port_event,
+                                     PORT_KEY)
 
 
 def init(init_board=True,
          bus=DEFAULT_SPI_BUS,
-         chip_select=DEFAULT_SPI_CHIP_SELECT):
+         chip_select=DEFAULT_SPI_CHIP_SELECT,
+         attach=False,
+         backend=None,
+         state_file=None):
     """Initialises all PiFace Digital boards. Only required when using
     :func:`digital_read` and :func:`digital_write`.
 
+    Every hardware_addr on every given bus and chip select is probed.
+    Each bus is probed in its own thread so that adding buses does not
+    add to the start up time.
+
+    >>> pifacedigitalio.init(chip_select=(0, 1))  # up to 8 boards
+    >>> pifacedigitalio.digital_read(0, hardware_addr=2, chip_select=1)
+    0
+
     :param init_board: Initialise each board (default: True)
     :type init_board: boolean
-    :param bus: SPI bus /dev/spidev<bus>.<chipselect> (default: {bus})
+    :param bus: SPI bus /dev/spidev<bus>.<chipselect>, or a list of them
+        (default: {bus})
     :type bus: int
-    :param chip_select: SPI chip select /dev/spidev<bus>.<chipselect>
-        (default: {chip})
+    :param chip_select: SPI chip select /dev/spidev<bus>.<chipselect>, or
+        a list of them (default: {chip})
     :type chip_select: int
+    :param attach: Attach to boards which are already set up instead of
+        initialising them, see :meth:`PiFaceDigital.attach_board`
+        (default: False)
+    :type attach: boolean
+    :param backend: Used by every board instead of the SPI device, see
+        :class:`PiFaceDigital` (default: None)
+    :param state_file: Each board's state_file is this followed by
+        .<bus>.<chip_select>.<hardware_addr>, see :class:`PiFaceDigital`
+        (default: None)
+    :type state_file: string
     :raises: :class:`NoPiFaceDigitalDetectedError`
     """.format(bus=DEFAULT_SPI_BUS, chip=DEFAULT_SPI_CHIP_SELECT)
+    buses = _as_tuple(bus)
+    chip_selects = _as_tuple(chip_select)
+    if len(buses) == 0 or len(chip_selects) == 0:
+        raise NoPiFaceDigitalDetectedError(
+            "No PiFace Digital board detected (no SPI bus or chip select "
+            "given).")
+    found_boards = list()
     failed_boards = list()
-    for hardware_addr in range(MAX_BOARDS):
-        try:
-            global _pifacedigitals
-            _pifacedigitals[hardware_addr] = PiFaceDigital(hardware_addr,
-                                                           bus,
-                                                           chip_select,
-                                                           init_board)
-        except NoPiFaceDigitalDetectedError as e:
-            failed_boards.append(e)
-    if len(failed_boards) >= MAX_BOARDS:
+    errors = list()
+    probes = [threading.Thread(target=_probe_bus,
+                               args=(b, chip_selects, init_board, attach,
+                                     backend, state_file, found_boards,
+                                     failed_boards, errors))
+              for b in buses]
+    # the calling thread probes the first bus itself
+    for probe in probes[1:]:
+        probe.start()
+    probes[0].run()
+    for probe in probes[1:]:
+        probe.join()
+
+    if len(errors) > 0:
+        for pfd in found_boards:
+            pfd.close_fd()  # don't leak the boards found on other devices
+        raise errors[0]
+
+    global _pifacedigitals
+    for pfd in found_boards:
+        _pifacedigitals[_board_key(pfd)] = pfd
+    if len(found_boards) == 0:
         raise failed_boards[0]
 
 
@@ -178,22 +1643,90 @@ def deinit(bus=DEFAULT_SPI_BUS,
     """Stops interrupts on all boards. Only required when using
     :func:`digital_read` and :func:`digital_write`.
 
-    :param bus: SPI bus /dev/spidev<bus>.<chipselect> (default: {bus})
+    :param bus: SPI bus /dev/spidev<bus>.<chipselect>, or a list of them
+        (default: {bus})
     :type bus: int
-    :param chip_select: SPI chip select /dev/spidev<bus>.<chipselect>
-        (default: {chip})
+    :param chip_select: SPI chip select /dev/spidev<bus>.<chipselect>, or
+        a list of them (default: {chip})
     :type chip_select: int
-    """
+    """.format(bus=DEFAULT_SPI_BUS, chip=DEFAULT_SPI_CHIP_SELECT)
+    buses = _as_tuple(bus)
+    chip_selects = _as_tuple(chip_select)
     global _pifacedigitals
-    for pfd in _pifacedigitals:
+    for key in sorted(_pifacedigitals.keys()):
+        b, c, hardware_addr = key
+        if b in buses and c in chip_selects:
+            _pifacedigitals.pop(key).deinit_board()
+
+
+def _probe_bus(bus, chip_selects, init_board, attach, backend, state_file,
+               found_boards, failed_boards, errors):
+    """Probes every hardware_addr on each chip select of one SPI bus.
+    Transfers on one bus are serialised by the kernel anyway, so buses are
+    probed in parallel but the boards on a bus are probed in turn.
+    """
+    for chip_select in chip_selects:
+        # a missing SPI device doesn't stop the other chip selects
         try:
-            pfd.deinit_board()
-        except AttributeError:
-            pass
+            for hardware_addr in range(MAX_BOARDS):
+                if state_file is None:
+                    board_state_file = None
+                else:
+                    board_state_file = "{}.{}.{}.{}".format(
+                        state_file, bus, chip_select, hardware_addr)
+                try:
+                    found_boards.append(PiFaceDigital(
+                        hardware_addr,
+                        bus,
+                        chip_select,
+                        init_board,
+                        attach=attach,
+                        state_file=board_state_file,
+                        backend=backend))
+                except NoPiFaceDigitalDetectedError as e:
+                    failed_boards.append(e)
+        except Exception as e:
+            errors.append(e)
+
+
+def _spi_speed_key(pfd):
+    return "{b}.{c}.{h}".format(b=pfd.bus,
+                                c=pfd.chip_select,
+                                h=pfd.hardware_addr)
+
+
+def _load_spi_speeds():
+    try:
+        with open(SPI_SPEED_CACHE_FILE) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()  # never tuned, or unreadable
+
+
+def _save_spi_speeds(spi_speeds):
+    try:
+        os.makedirs(os.path.dirname(SPI_SPEED_CACHE_FILE))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    with open(SPI_SPEED_CACHE_FILE, 'w') as f:
+        json.dump(spi_speeds, f, indent=4, sort_keys=True)
+
+
+def _as_tuple(bus_or_chip_select):
+    try:
+        return tuple(bus_or_chip_select)
+    except TypeError:
+        return (bus_or_chip_select,)
+
+
+def _board_key(pfd):
+    return (pfd.bus, pfd.chip_select, pfd.hardware_addr)
 
 
 # wrapper functions for backwards compatibility
-def digital_read(pin_num, hardware_addr=0):
+def digital_read(pin_num, hardware_addr=0,
+                 bus=DEFAULT_SPI_BUS, chip_select=DEFAULT_SPI_CHIP_SELECT):
     """Returns the value of the input pin specified.
 
     .. note:: This function is for familiarality with users of other types of
@@ -208,12 +1741,18 @@ def digital_read(pin_num, hardware_addr=0):
     :type pin_num: int
     :param hardware_addr: The board to read from (default: 0)
     :type hardware_addr: int
+    :param bus: SPI bus of the board (default: 0)
+    :type bus: int
+    :param chip_select: SPI chip select of the board (default: 0)
+    :type chip_select: int
     :returns: int -- value of the pin
     """
-    return _get_pifacedigital(hardware_addr).input_pins[pin_num].value
+    pfd = _get_pifacedigital(hardware_addr, bus, chip_select)
+    return pfd.input_pins[pin_num].value
 
 
-def digital_write(pin_num, value, hardware_addr=0):
+def digital_write(pin_num, value, hardware_addr=0,
+                  bus=DEFAULT_SPI_BUS, chip_select=DEFAULT_SPI_CHIP_SELECT):
     """Writes the value to the input pin specified.
 
     .. note:: This function is for familiarality with users of other types of
@@ -229,43 +1768,53 @@ def digital_write(pin_num, value, hardware_addr=0):
     :type value: int
     :param hardware_addr: The board to read from (default: 0)
     :type hardware_addr: int
+    :param bus: SPI bus of the board (default: 0)
+    :type bus: int
+    :param chip_select: SPI chip select of the board (default: 0)
+    :type chip_select: int
     """
-    _get_pifacedigital(hardware_addr).output_pins[pin_num].value = value
+    pfd = _get_pifacedigital(hardware_addr, bus, chip_select)
+    pfd.output_pins[pin_num].value = value
 
 
-def digital_read_pullup(pin_num, hardware_addr=0):
+def digital_read_pullup(pin_num, hardware_addr=0,
+                        bus=DEFAULT_SPI_BUS,
+                        chip_select=DEFAULT_SPI_CHIP_SELECT):
     """Returns the value of the input pullup specified.
 
     .. note:: This function is for familiarality with users of other types of
-       IO board. Consider accessing the ``gppub`` attribute of a
-       PiFaceDigital object:
+       IO board. Consider reading all of the pullups from memory with
+       the ``config_register`` method of a PiFaceDigital object:
 
        >>> pfd = PiFaceDigital(hardware_addr)
-       >>> hex(pfd.gppub.value)
+       >>> hex(pfd.config_register(pifacecommon.mcp23s17.GPPUB))
        0xff
-       >>> pfd.gppub.bits[pin_num].value
-       1
 
     :param pin_num: The pin number to read.
     :type pin_num: int
     :param hardware_addr: The board to read from (default: 0)
     :type hardware_addr: int
+    :param bus: SPI bus of the board (default: 0)
+    :type bus: int
+    :param chip_select: SPI chip select of the board (default: 0)
+    :type chip_select: int
     :returns: int -- value of the pin
     """
-    return _get_pifacedigital(hardware_addr).gppub.bits[pin_num].value
+    pfd = _get_pifacedigital(hardware_addr, bus, chip_select)
+    return (pfd.config_register(pifacecommon.mcp23s17.GPPUB) >> pin_num) & 1
 
 
-def digital_write_pullup(pin_num, value, hardware_addr=0):
+def digital_write_pullup(pin_num, value, hardware_addr=0,
+                         bus=DEFAULT_SPI_BUS,
+                         chip_select=DEFAULT_SPI_CHIP_SELECT):
     """Writes the value to the input pullup specified.
 
     .. note:: This function is for familiarality with users of other types of
-       IO board. Consider accessing the ``gppub`` attribute of a
-       PiFaceDigital object:
+       IO board. Consider setting all of the pullups at once with the
+       ``configure`` method of a PiFaceDigital object:
 
        >>> pfd = PiFaceDigital(hardware_addr)
-       >>> hex(pfd.gppub.value)
-       0xff
-       >>> pfd.gppub.bits[pin_num].value = 1
+       >>> pfd.configure(pullups=0xFF)
 
     :param pin_num: The pin number to write to.
     :type pin_num: int
@@ -273,14 +1822,30 @@ def digital_write_pullup(pin_num, value, hardware_addr=0):
     :type value: int
     :param hardware_addr: The board to read from (default: 0)
     :type hardware_addr: int
+    :param bus: SPI bus of the board (default: 0)
+    :type bus: int
+    :param chip_select: SPI chip select of the board (default: 0)
+    :type chip_select: int
     """
-    _get_pifacedigital(hardware_addr).gppub.bits[pin_num].value = value
+    pfd = _get_pifacedigital(hardware_addr, bus, chip_select)
+    # configure takes both port locks, port A first
+    with pfd.port_lock(pifacecommon.mcp23s17.GPIOA):
+        with pfd.port_lock(pifacecommon.mcp23s17.GPIOB):
+            pullups = pfd.config_register(pifacecommon.mcp23s17.GPPUB)
+            if value:
+                pullups |= 1 << pin_num
+            else:
+                pullups &= ~(1 << pin_num)
+            pfd.configure(pullups=pullups)
 
 
-def _get_pifacedigital(hardware_addr):
+def _get_pifacedigital(hardware_addr,
+                       bus=DEFAULT_SPI_BUS,
+                       chip_select=DEFAULT_SPI_CHIP_SELECT):
     global _pifacedigitals
-    if _pifacedigitals[hardware_addr] is None:
-        raise NoPiFaceDigitalError("There is no PiFace Digital with "
-                                   "hardware_addr {}".format(hardware_addr))
-    else:
-        return _pifacedigitals[hardware_addr]
+    try:
+        return _pifacedigitals[(bus, chip_select, hardware_addr)]
+    except KeyError:
+        raise NoPiFaceDigitalError(
+            "There is no PiFace Digital with hardware_addr {h} (bus={b}, "
+            "chip_select={c})".format(h=hardware_addr, b=bus, c=chip_select))
@@ -0,0 +1,266 @@
+"""Keeps PiFace Digital boards open and serves them over a Unix socket, so
+that shell scripts don't pay for starting Python and setting up the boards
+on every command.
+
+Start the daemon (boards are attached to, not reinitialised, so the
+outputs are left as they are)::
+
+    $ python -m pifacedigitalio.daemon --chip-select 0 1
+
+and use the ``pifacedigitalio`` command::
+
+    $ pifacedigitalio read 3
+    1
+    $ pifacedigitalio write 7 1
+    $ pifacedigitalio watch --board 0.1.2
+
+The protocol is one command per line, answered with ``ok [value]`` or
+``error message``. BOARD is ``hardware_addr`` or
+``bus.chip_select.hardware_addr``::
+
+    read BOARD [PIN]        input port or pin
+    outputs BOARD [PIN]     output port or pin
+    write BOARD PIN VALUE   output pin
+    writeport BOARD VALUE   output port
+    watch BOARD             then one "PIN DIRECTION" line per input event
+
+so ``echo "read 0 3" | nc -U /run/pifacedigitalio.sock`` works too.
+"""
+import argparse
+import inspect
+import os
+import select
+import signal
+import threading
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver  # Python 2
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # Python 2
+import pifacedigitalio
+import pifacedigitalio.core
+
+
+DEFAULT_SOCKET = os.environ.get("PIFACEDIGITALIO_SOCKET",
+                                "/run/pifacedigitalio.sock")
+SOCKET_MODE = 0o660
+# how often a watch checks whether its client has gone
+WATCH_POLL_TIME = 1
+
+
+class CommandError(Exception):
+    pass
+
+
+def _takes_arguments(command, count):
+    """Returns True if the bound method command takes count arguments."""
+    try:
+        spec = inspect.getfullargspec(command)
+    except AttributeError:
+        spec = inspect.getargspec(command)  # Python 2
+    most = len(spec.args) - 1  # not self
+    return most - len(spec.defaults or ()) <= count <= most
+
+
+class Watchers(object):
+    """Fans input events on one board out to every watching client. The
+    board's InputEventListener is started with the first watcher.
+    """
+    def __init__(self, pfd):
+        self.pfd = pfd
+        self.queues = list()
+        self.lock = threading.Lock()
+        self.listener = None
+
+    def add(self):
+        event_queue = queue.Queue()
+        with self.lock:
+            if self.listener is None:
+                self.listener = pifacedigitalio.InputEventListener(
+                    chip=self.pfd, daemon=True)
+                for pin_num in range(8):
+                    self.listener.register(pin_num,
+                                           pifacedigitalio.IODIR_BOTH,
+                                           self.put)
+                self.listener.activate()
+            self.queues.append(event_queue)
+        return event_queue
+
+    def remove(self, event_queue):
+        with self.lock:
+            self.queues.remove(event_queue)
+
+    def put(self, event):
+        with self.lock:
+            for event_queue in self.queues:
+                event_queue.put(event)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.deactivate()
+
+
+class Daemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves the boards registered by :func:`pifacedigitalio.init`."""
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # left over from a previous run
+        socketserver.UnixStreamServer.__init__(self, socket_path,
+                                               CommandHandler)
+        os.chmod(socket_path, SOCKET_MODE)
+        self.socket_path = socket_path
+        self.watchers = dict()
+        self.watchers_lock = threading.Lock()
+
+    def board(self, board):
+        """Returns the PiFaceDigital for BOARD."""
+        try:
+            fields = [int(field) for field in board.split(".")]
+        except ValueError:
+            raise CommandError("bad board {}".format(board))
+        if len(fields) == 1:
+            bus = pifacedigitalio.DEFAULT_SPI_BUS
+            chip_select = pifacedigitalio.DEFAULT_SPI_CHIP_SELECT
+            hardware_addr = fields[0]
+        elif len(fields) == 3:
+            bus, chip_select, hardware_addr = fields
+        else:
+            raise CommandError("bad board {}".format(board))
+        try:
+            return pifacedigitalio.core._get_pifacedigital(hardware_addr,
+                                                           bus,
+                                                           chip_select)
+        except pifacedigitalio.NoPiFaceDigitalError as e:
+            raise CommandError(str(e))
+
+    def watch(self, pfd):
+        with self.watchers_lock:
+            if pfd not in self.watchers:
+                self.watchers[pfd] = Watchers(pfd)
+            return self.watchers[pfd]
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        for watchers in self.watchers.values():
+            watchers.close()
+        os.remove(self.socket_path)
+
+
+class CommandHandler(socketserver.StreamRequestHandler):
+    """Runs the commands from one client."""
+    def handle(self):
+        try:
+            self.run_commands()
+        except (IOError, OSError, EOFError):
+            pass  # client has gone
+
+    def run_commands(self):
+        for line in iter(self.rfile.readline, b""):
+            args = line.decode().split()
+            if len(args) == 0:
+                continue
+            try:
+                command = getattr(self, "do_" + args[0], None)
+                if command is None:
+                    raise CommandError("unknown command {}".format(args[0]))
+                if not _takes_arguments(command, len(args) - 1):
+                    raise CommandError("wrong arguments for {}".format(
+                        args[0]))
+                try:
+                    reply = command(*args[1:])
+                except (ValueError, IndexError) as e:
+                    raise CommandError(str(e))
+            except CommandError as e:
+                self.reply("error {}".format(e))
+            else:
+                if reply is None:
+                    self.reply("ok")
+                else:
+                    self.reply("ok {}".format(reply))
+
+    def reply(self, line):
+        self.wfile.write((line + "\n").encode())
+        self.wfile.flush()
+
+    def do_read(self, board, pin_num=None):
+        pfd = self.server.board(board)
+        if pin_num is None:
+            return pfd.input_port.value
+        else:
+            return pfd.input_pins[int(pin_num)].value
+
+    def do_outputs(self, board, pin_num=None):
+        pfd = self.server.board(board)
+        if pin_num is None:
+            return pfd.output_port.value
+        else:
+            return pfd.output_pins[int(pin_num)].value
+
+    def do_write(self, board, pin_num, value):
+        self.server.board(board).output_pins[int(pin_num)].value = \
+            int(value)
+
+    def do_writeport(self, board, value):
+        self.server.board(board).output_port.value = int(value, 0)
+
+    def do_watch(self, board):
+        watchers = self.server.watch(self.server.board(board))
+        event_queue = watchers.add()
+        self.reply("ok")
+        try:
+            while True:
+                try:
+                    event = event_queue.get(timeout=WATCH_POLL_TIME)
+                except queue.Empty:
+                    # a closed connection reads as end of file
+                    readable, w, x = select.select([self.connection],
+                                                   [], [], 0)
+                    if readable and not self.connection.recv(1):
+                        raise EOFError
+                    continue
+                self.reply("{} {}".format(event.pin_num, event.direction))
+        finally:
+            watchers.remove(event_queue)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve PiFace Digital boards on a Unix socket.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET,
+                        help="default: {}".format(DEFAULT_SOCKET))
+    parser.add_argument("--bus", type=int, nargs="+",
+                        default=[pifacedigitalio.DEFAULT_SPI_BUS])
+    parser.add_argument("--chip-select", type=int, nargs="+",
+                        default=[pifacedigitalio.DEFAULT_SPI_CHIP_SELECT])
+    parser.add_argument("--state-file",
+                        help="save outputs here and restore them after a "
+                             "power loss")
+    args = parser.parse_args()
+
+    pifacedigitalio.init(bus=args.bus,
+                         chip_select=args.chip_select,
+                         attach=True,
+                         state_file=args.state_file)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # shut down cleanly when stopped by the service manager
+    signal.signal(signal.SIGTERM, stop)
+    daemon = Daemon(args.socket)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+        pifacedigitalio.deinit(bus=args.bus, chip_select=args.chip_select)
+
+
+if __name__ == "__main__":
+    main()
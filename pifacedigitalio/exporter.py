@@ -0,0 +1,212 @@
+"""Serves metrics about PiFace Digital boards and their
+:class:`pifacedigitalio.InputEventListener` s in the Prometheus text
+format.
+
+>>> from pifacedigitalio.exporter import MetricsExporter
+>>> pifacedigitalio.init()
+>>> listener = pifacedigitalio.InputEventListener(
+...     chip=pifacedigitalio.core._get_pifacedigital(0, 0, 0))
+>>> listener.activate()
+>>> exporter = MetricsExporter(listeners=[listener])
+>>> exporter.start()
+
+then scrape http://127.0.0.1:9787/metrics.
+
+Metrics are made from values the library keeps in memory anyway, so a
+scrape never causes an SPI transaction however often it happens. Input
+metrics come from the listeners (an input port is only known once it has
+interrupted).
+"""
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+import pifacedigitalio.core
+
+
+DEFAULT_ADDRESS = "127.0.0.1"
+DEFAULT_PORT = 9787
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "pifacedigitalio_"
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+def callback_label(callback):
+    """Returns module.name of a callback function."""
+    name = getattr(callback, "__qualname__",
+                   getattr(callback, "__name__", None))
+    if name is None:
+        return repr(callback)
+    module = getattr(callback, "__module__", None)
+    return name if module is None else "{}.{}".format(module, name)
+
+
+def board_label(board):
+    return "{}.{}.{}".format(board.bus, board.chip_select,
+                             board.hardware_addr)
+
+
+class Metrics(object):
+    """Builds up the text of a scrape, keeping the samples of each metric
+    together.
+    """
+    def __init__(self):
+        self.families = list()
+        self.samples = dict()
+
+    def add(self, family, metric_type, description, value, suffix="",
+            **labels):
+        family = PREFIX + family
+        if family not in self.samples:
+            self.families.append(family)
+            self.samples[family] = [
+                "# HELP {} {}".format(family, description),
+                "# TYPE {} {}".format(family, metric_type)]
+        name = family + suffix
+        label_text = ",".join(
+            '{}="{}"'.format(key, escape_label_value(labels[key]))
+            for key in sorted(labels))
+        if label_text:
+            name = "{}{{{}}}".format(name, label_text)
+        self.samples[family].append("{} {}".format(name, value))
+
+    def text(self):
+        lines = list()
+        for family in self.families:
+            lines.extend(self.samples[family])
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter(object):
+    """Serves /metrics over HTTP from a background thread.
+
+    :param address: The address to listen on (default: 127.0.0.1).
+    :type address: string
+    :param port: The port to listen on (default: 9787).
+    :type port: int
+    :param boards: The boards to report (default: the boards found by
+        :func:`pifacedigitalio.init` and the listeners' boards).
+    :type boards: list
+    :param listeners: The listeners to report.
+    :type listeners: list
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, port=DEFAULT_PORT,
+                 boards=None, listeners=()):
+        self.boards = boards
+        self.listeners = list(listeners)
+        self.server = MetricsServer((address, port), MetricsHandler)
+        self.server.exporter = self
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def collect(self):
+        """Returns the metrics text."""
+        metrics = Metrics()
+        boards = self.boards
+        if boards is None:
+            registered = pifacedigitalio.core._pifacedigitals
+            boards = [registered[key] for key in sorted(registered)]
+        boards = list(boards)
+        for listener in self.listeners:
+            if listener.chip not in boards:
+                boards.append(listener.chip)
+
+        for board in boards:
+            label = board_label(board)
+            if board._output_latch is not None:
+                metrics.add("output_port", "gauge",
+                            "Last value written to the output port.",
+                            board._output_latch, board=label)
+            metrics.add("spi_errors_total", "counter",
+                        "Failed SPI transfers.",
+                        board.spi_errors, board=label)
+            metrics.add("resets_total", "counter",
+                        "Board resets found and put back by check_config.",
+                        board.resets, board=label)
+
+        for index, listener in enumerate(self.listeners):
+            self._collect_listener(metrics, listener, str(index))
+        return metrics.text()
+
+    def _collect_listener(self, metrics, listener, index):
+        labels = {"board": board_label(listener.chip), "listener": index}
+        event_queue = listener.event_queue
+        if event_queue.inputs is not None:
+            metrics.add("input_port", "gauge",
+                        "Input port at the last interrupt.",
+                        event_queue.inputs, **labels)
+        for pin_num, edges in enumerate(event_queue.edges):
+            metrics.add("input_edges_total", "counter",
+                        "Interrupts flagged on each input pin.",
+                        edges, pin=pin_num, **labels)
+        metrics.add("interrupts_total", "counter",
+                    "Interrupts decoded by the listener.",
+                    event_queue.interrupts, **labels)
+        metrics.add("event_queue_depth", "gauge",
+                    "Events waiting for the dispatcher.",
+                    event_queue.depth, **labels)
+        metrics.add("event_queue_high_water", "gauge",
+                    "Most events there have been in the queue.",
+                    event_queue.high_water, **labels)
+        metrics.add("events_dropped_total", "counter",
+                    "Events dropped because the queue was full.",
+                    event_queue.dropped, **labels)
+        metrics.add("events_coalesced_total", "counter",
+                    "Events replaced by later ones because the queue was "
+                    "full.", event_queue.coalesced, **labels)
+        metrics.add("dispatch_delay_seconds", "summary",
+                    "Time from interrupt to dispatch.",
+                    event_queue.dispatch_delay_total_ns / 1e9, "_sum",
+                    **labels)
+        metrics.add("dispatch_delay_seconds", "summary", "",
+                    event_queue.dispatched, "_count", **labels)
+        # callbacks with the same name (lambdas, say) are added together
+        callbacks = dict()
+        for callback, stats in list(listener.callback_stats.items()):
+            name = callback_label(callback)
+            total_ns, calls = callbacks.get(name, (0, 0))
+            callbacks[name] = (total_ns + stats.total_ns, calls + stats.calls)
+        for name in sorted(callbacks):
+            total_ns, calls = callbacks[name]
+            metrics.add("callback_seconds", "summary",
+                        "Time spent in callbacks.", total_ns / 1e9, "_sum",
+                        callback=name, **labels)
+            metrics.add("callback_seconds", "summary", "", calls, "_count",
+                        callback=name, **labels)
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.exporter.collect().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would fill the log
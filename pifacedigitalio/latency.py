@@ -0,0 +1,248 @@
+"""Measures how long an input edge takes to reach a callback registered with
+:class:`pifacedigitalio.InputEventListener`.
+
+Each event is timed at every stage of the event path:
+
+- origin: the edge is made (output written, or simulated input changed)
+- wake: the detector wakes on the interrupt line and starts reading INTFB
+- read: INTFB and INTCAPB have been read
+- queued: the event has been put on the event queue
+- dispatched: the dispatcher has taken the event off the queue
+- callback: the callback has started
+- written: the callback has written an output (with --write-back)
+
+Loop an output back to an input with a wire (output 7 to input 7 here)::
+
+    $ python -m pifacedigitalio.latency --loopback 7 7 --events 1000
+
+or run against the simulator instead of a PiFace Digital::
+
+    $ python -m pifacedigitalio.latency --simulate --events 1000 --load 2
+"""
+from __future__ import print_function
+import argparse
+import threading
+import time
+import pifacecommon.mcp23s17
+import pifacedigitalio
+import pifacedigitalio.simulator
+
+
+STAGES = ("origin", "wake", "read", "queued", "dispatched", "callback",
+          "written")
+PERCENTILES = (50, 90, 99, 99.9)
+HISTOGRAM_WIDTH = 50
+
+try:
+    perf_counter_ns = time.perf_counter_ns
+except AttributeError:
+    # Python < 3.7
+    _perf_counter = getattr(time, 'perf_counter', time.time)
+
+    def perf_counter_ns():
+        return int(_perf_counter() * 1e9)
+
+
+class LatencyRecorder(object):
+    """Records when each stage of one event at a time was reached."""
+    def __init__(self):
+        self.times = dict()
+        self.samples = list()
+        self.callback_done = threading.Event()
+
+    def stamp(self, stage):
+        # only the first interrupt after the origin belongs to this event
+        if stage not in self.times:
+            self.times[stage] = perf_counter_ns()
+
+    def start(self):
+        self.times = dict()
+        self.callback_done.clear()
+        self.stamp("origin")
+
+    def finish(self):
+        self.samples.append(self.times)
+
+
+def instrument(pfd, listener, recorder):
+    """Stamps the detector and dispatcher stages of pfd's listener without
+    changing the library: the detector's first read after waking is INTFB
+    and the dispatcher takes events off the queue with get().
+    """
+    chip_read = pfd.read
+
+    def read(address):
+        if address == pifacecommon.mcp23s17.INTFB:
+            recorder.stamp("wake")
+        value = chip_read(address)
+        if address == pifacecommon.mcp23s17.INTCAPB:
+            recorder.stamp("read")
+        return value
+
+    pfd.read = read
+
+    event_queue = listener.event_queue
+    queue_put = event_queue.put
+    queue_get = event_queue.get
+
+    def put(thing):
+        recorder.stamp("queued")
+        queue_put(thing)
+
+    def get(*args, **kwargs):
+        thing = queue_get(*args, **kwargs)
+        recorder.stamp("dispatched")
+        return thing
+
+    event_queue.put = put
+    event_queue.get = get
+
+
+def generate_load(pfd, stop):
+    """Keeps the SPI bus busy, as other threads using the board would."""
+    while not stop.is_set():
+        pfd.output_port.value
+
+
+def measure(pfd, listener, recorder, make_edge, input_pin,
+            events, interval, write_back_pin, timeout=1):
+    """Makes edges one at a time and waits for each callback.
+    Returns the number of edges which never reached the callback.
+    """
+    def callback(event):
+        recorder.stamp("callback")
+        if write_back_pin is not None:
+            pfd.output_pins[write_back_pin].toggle()
+            recorder.stamp("written")
+        recorder.callback_done.set()
+
+    listener.register(input_pin, pifacedigitalio.IODIR_BOTH, callback,
+                      settle_time=0)
+    instrument(pfd, listener, recorder)
+    listener.activate()
+    lost = 0
+    try:
+        for i in range(events):
+            recorder.start()
+            make_edge(i % 2 == 0)
+            if recorder.callback_done.wait(timeout):
+                recorder.finish()
+            else:
+                lost += 1
+            time.sleep(interval)
+    finally:
+        listener.deactivate()
+    return lost
+
+
+def percentile(sorted_values, percent):
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def report(samples, lost):
+    """Prints percentiles for each stage, and from the first stage to each
+    stage, followed by a histogram of the whole path. Times are in
+    microseconds.
+    """
+    print("{} events, {} lost".format(len(samples), lost))
+    if len(samples) == 0:
+        return
+    stages = [stage for stage in STAGES if stage in samples[0]]
+    print("{:<22}".format("(us)") +
+          "".join("{:>10}".format("p{}".format(p)) for p in PERCENTILES) +
+          "{:>10}".format("max"))
+    for previous, stage in zip(stages, stages[1:]):
+        print_percentiles("{}->{}".format(previous, stage),
+                          durations(samples, previous, stage))
+    for stage in stages[2:]:
+        print_percentiles("{}->{}".format(stages[0], stage),
+                          durations(samples, stages[0], stage))
+    print()
+    print_histogram(durations(samples, stages[0], stages[-1]),
+                    "{}->{} (us)".format(stages[0], stages[-1]))
+
+
+def durations(samples, start, end):
+    return sorted((sample[end] - sample[start]) / 1000.0
+                  for sample in samples)
+
+
+def print_percentiles(name, values):
+    print("{:<22}".format(name) +
+          "".join("{:>10.1f}".format(percentile(values, p))
+                  for p in PERCENTILES) +
+          "{:>10.1f}".format(values[-1]))
+
+
+def print_histogram(values, title):
+    """Prints values in power of two buckets."""
+    print(title)
+    counts = dict()
+    for value in values:
+        bucket = 1
+        while bucket < value:
+            bucket *= 2
+        counts[bucket] = counts.get(bucket, 0) + 1
+    most = max(counts.values())
+    bucket = min(counts)
+    while bucket <= max(counts):
+        count = counts.get(bucket, 0)
+        bar = "#" * int(round(float(count) / most * HISTOGRAM_WIDTH))
+        print("<={:>9} {:>7} {}".format(bucket, count, bar))
+        bucket *= 2
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure PiFace Digital input event latency.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--loopback", nargs=2, type=int, metavar=("OUTPUT", "INPUT"),
+        help="output pin wired to an input pin")
+    source.add_argument(
+        "--simulate", action="store_true",
+        help="use the simulator instead of a PiFace Digital")
+    parser.add_argument("--hardware-addr", type=int, default=0)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=0.005,
+                        help="seconds between events (default: 0.005)")
+    parser.add_argument("--load", type=int, default=0,
+                        help="threads reading the board while measuring")
+    parser.add_argument("--write-back", type=int, metavar="OUTPUT",
+                        help="toggle this output in the callback")
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulator = pifacedigitalio.simulator.MCP23S17Simulator(
+            hardware_addrs=(args.hardware_addr,))
+        pfd = pifacedigitalio.PiFaceDigital(args.hardware_addr,
+                                            backend=simulator)
+        input_pin = 0
+
+        def make_edge(on):
+            simulator.set_input_pin(input_pin, on, args.hardware_addr)
+    else:
+        pfd = pifacedigitalio.PiFaceDigital(args.hardware_addr)
+        output_pin, input_pin = args.loopback
+
+        def make_edge(on):
+            pfd.output_pins[output_pin].value = 1 if on else 0
+
+    recorder = LatencyRecorder()
+    listener = pifacedigitalio.InputEventListener(chip=pfd, daemon=True)
+    stop_load = threading.Event()
+    for i in range(args.load):
+        load = threading.Thread(target=generate_load, args=(pfd, stop_load))
+        load.daemon = True
+        load.start()
+    try:
+        lost = measure(pfd, listener, recorder, make_edge, input_pin,
+                       args.events, args.interval, args.write_back)
+    finally:
+        stop_load.set()
+    report(recorder.samples, lost)
+
+
+if __name__ == "__main__":
+    main()
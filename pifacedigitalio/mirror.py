@@ -0,0 +1,254 @@
+"""Shares the state of a PiFace Digital with other processes through shared
+memory, so that any number of them can read it without SPI transactions.
+
+The process which owns the board publishes its state:
+
+>>> pfd = pifacedigitalio.PiFaceDigital()
+>>> pfd.publish_state()
+>>> listener = pifacedigitalio.InputEventListener(chip=pfd)
+>>> listener.activate()  # keeps the published inputs up to date
+
+and other processes read it:
+
+>>> from pifacedigitalio.mirror import PiFaceDigitalMirror
+>>> mirror = PiFaceDigitalMirror()
+>>> mirror.input_pins[0].value
+1
+>>> mirror.output_port.value
+170
+
+The state is one block of memory protected by a sequence lock: the owner
+makes the sequence number odd while it writes, and readers retry until they
+read the same even sequence number before and after copying the block.
+Readers never block the owner.
+"""
+import mmap
+import os
+import struct
+import threading
+import time
+
+
+MIRROR_DIR = "/dev/shm"
+MAGIC = b"PFD1"  # the last character is the layout version
+# magic, sequence, inputs, outputs, input_changed_ns, output_changed_ns,
+# changes on each input pin, changes on each output pin
+LAYOUT = struct.Struct("<4sIBBxxqq8I8I")
+SEQUENCE = struct.Struct("<I")
+SEQUENCE_OFFSET = 4
+# seconds a reader waits for the owner to finish writing
+READ_TIMEOUT = 1
+COUNTER_MASK = 0xFFFFFFFF
+
+
+class MirrorError(Exception):
+    pass
+
+
+def mirror_path(hardware_addr=0, bus=0, chip_select=0):
+    """Returns where the state of a board is published by default."""
+    return os.path.join(MIRROR_DIR, "pifacedigitalio-{}.{}.{}".format(
+        bus, chip_select, hardware_addr))
+
+
+class StatePublisher(object):
+    """Writes the state of one board to shared memory. Made by
+    :meth:`pifacedigitalio.PiFaceDigital.publish_state`.
+
+    :param path: The shared memory file.
+    :type path: string
+    :param inputs: The input port value.
+    :type inputs: int
+    :param outputs: The output port value.
+    :type outputs: int
+    """
+    def __init__(self, path, inputs, outputs):
+        self.path = path
+        self.lock = threading.Lock()  # one writer at a time
+        self.sequence = 0
+        self.inputs = inputs
+        self.outputs = outputs
+        self.input_changed_ns = self.output_changed_ns = 0
+        self.input_counts = [0] * 8
+        self.output_counts = [0] * 8
+        self.closed = False
+
+        # readers only ever see a complete block
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        fd = os.open(temp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, b"\0" * LAYOUT.size)
+            self.memory = mmap.mmap(fd, LAYOUT.size)
+        finally:
+            os.close(fd)
+        self._write()
+        os.rename(temp_path, path)
+
+    def publish_inputs(self, inputs, timestamp_ns):
+        """Publishes the input port value.
+
+        :param inputs: The input port value.
+        :type inputs: int
+        :param timestamp_ns: When inputs was read (``time.monotonic_ns()``).
+        :type timestamp_ns: int
+        """
+        with self.lock:
+            changed = inputs ^ self.inputs
+            if changed and not self.closed:
+                self.inputs = inputs
+                self.input_changed_ns = timestamp_ns
+                _count(self.input_counts, changed)
+                self._write()
+
+    def publish_outputs(self, outputs, timestamp_ns):
+        """Publishes the output port value, see :meth:`publish_inputs`."""
+        with self.lock:
+            changed = outputs ^ self.outputs
+            if changed and not self.closed:
+                self.outputs = outputs
+                self.output_changed_ns = timestamp_ns
+                _count(self.output_counts, changed)
+                self._write()
+
+    def _write(self):
+        self.sequence = (self.sequence + 1) & COUNTER_MASK
+        SEQUENCE.pack_into(self.memory, SEQUENCE_OFFSET, self.sequence)
+        LAYOUT.pack_into(self.memory, 0, MAGIC, self.sequence,
+                         self.inputs, self.outputs,
+                         self.input_changed_ns, self.output_changed_ns,
+                         *(self.input_counts + self.output_counts))
+        self.sequence = (self.sequence + 1) & COUNTER_MASK
+        SEQUENCE.pack_into(self.memory, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        """Stops publishing. Readers keep the last state. Later changes
+        are ignored.
+        """
+        with self.lock:  # not while a change is being written
+            if self.closed:
+                return
+            self.closed = True
+            self.memory.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _count(counts, changed):
+    for pin_num in range(8):
+        if changed & (1 << pin_num):
+            counts[pin_num] = (counts[pin_num] + 1) & COUNTER_MASK
+
+
+class MirrorState(object):
+    """A consistent copy of a published board state.
+
+    :attribute: inputs -- the input port value.
+    :attribute: outputs -- the output port value.
+    :attribute: input_changed_ns -- ``time.monotonic_ns()`` when the inputs
+        last changed (0 if they haven't).
+    :attribute: output_changed_ns -- the same for the outputs.
+    :attribute: input_counts -- changes on each input pin (modulo 2**32).
+    :attribute: output_counts -- changes on each output pin.
+    """
+    def __init__(self, fields):
+        (magic, sequence, self.inputs, self.outputs,
+         self.input_changed_ns, self.output_changed_ns) = fields[:6]
+        self.input_counts = fields[6:14]
+        self.output_counts = fields[14:22]
+
+
+class MirrorRegister(object):
+    """A read only port of a :class:`PiFaceDigitalMirror`."""
+    def __init__(self, mirror, attribute):
+        self.mirror = mirror
+        self.attribute = attribute
+
+    @property
+    def value(self):
+        return getattr(self.mirror.read(), self.attribute)
+
+
+class MirrorRegisterBit(MirrorRegister):
+    """A read only pin of a :class:`PiFaceDigitalMirror`."""
+    def __init__(self, bit_num, mirror, attribute):
+        super(MirrorRegisterBit, self).__init__(mirror, attribute)
+        self.bit_num = bit_num
+
+    @property
+    def value(self):
+        return (super(MirrorRegisterBit, self).value >> self.bit_num) & 1
+
+
+class PiFaceDigitalMirror(object):
+    """Reads the state of a PiFace Digital published by another process,
+    with the same attributes as :class:`pifacedigitalio.PiFaceDigital`
+    (read only).
+
+    :param hardware_addr: The board (default: 0).
+    :type hardware_addr: int
+    :param bus: The SPI bus of the board (default: 0).
+    :type bus: int
+    :param chip_select: The SPI chip select of the board (default: 0).
+    :type chip_select: int
+    :param path: The shared memory file, instead of the board's default.
+    :type path: string
+    :raises: :class:`MirrorError` if the board is not being published,
+        or the file is not a published state this version can read.
+    """
+    def __init__(self, hardware_addr=0, bus=0, chip_select=0, path=None):
+        if path is None:
+            path = mirror_path(hardware_addr, bus, chip_select)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            raise MirrorError(
+                "The state of PiFace Digital {} is not published "
+                "(bus={}, chip_select={}).".format(hardware_addr, bus,
+                                                   chip_select))
+        try:
+            if os.fstat(fd).st_size != LAYOUT.size:
+                raise MirrorError("{} is not a published PiFace Digital "
+                                  "state (or has a different layout)."
+                                  .format(path))
+            self.memory = mmap.mmap(fd, LAYOUT.size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        # published files are complete before they appear, and the magic
+        # never changes
+        if self.memory[:len(MAGIC)] != MAGIC:
+            self.memory.close()
+            raise MirrorError("{} is not a published PiFace Digital state "
+                              "(or has a different layout).".format(path))
+
+        self.input_pins = [MirrorRegisterBit(i, self, "inputs")
+                           for i in range(8)]
+        self.input_port = MirrorRegister(self, "inputs")
+        self.output_pins = [MirrorRegisterBit(i, self, "outputs")
+                            for i in range(8)]
+        self.output_port = MirrorRegister(self, "outputs")
+        self.leds = self.output_pins
+        self.relays = self.output_pins[:2]
+        self.switches = self.input_pins[:4]
+
+    def read(self):
+        """Returns a consistent :class:`MirrorState`."""
+        memory = self.memory
+        deadline = None
+        while True:
+            sequence = SEQUENCE.unpack_from(memory, SEQUENCE_OFFSET)[0]
+            if not sequence & 1:
+                fields = LAYOUT.unpack_from(memory)
+                if SEQUENCE.unpack_from(memory, SEQUENCE_OFFSET)[0] == \
+                        sequence:
+                    return MirrorState(fields)
+            # the owner is writing
+            if deadline is None:
+                deadline = time.time() + READ_TIMEOUT
+            elif time.time() > deadline:
+                raise MirrorError("The owner stopped while writing.")
+            time.sleep(0)
+
+    def close(self):
+        self.memory.close()
@@ -0,0 +1,203 @@
+"""Rules which drive the outputs of a PiFace Digital straight from its
+inputs, without a round trip through Python callbacks.
+
+Rules are compiled into 256 entry lookup tables (one entry per input port
+value) and run by the detector of an :class:`InputEventListener` as soon as
+an interrupt has been decoded, so reacting to an input costs a table lookup
+and one write to the output port.
+
+>>> from pifacedigitalio.rules import Follow, ToggleOnEdge, Interlock
+>>> pfd = pifacedigitalio.PiFaceDigital()
+>>> pfd.set_rules([Follow(2, 2),            # output 2 mirrors input 2
+...                ToggleOnEdge(0, 0),      # switch 0 toggles relay 0
+...                Interlock(0, (3,))])     # input 3 holds relay 0 off
+>>> listener = pifacedigitalio.InputEventListener(chip=pfd)
+>>> listener.activate()
+"""
+from pifacecommon.interrupts import IODIR_ON, IODIR_OFF, IODIR_BOTH
+
+
+TABLE_SIZE = 256
+
+
+class Rule(object):
+    """A rule driving one output pin. (This is an abstract class.)"""
+    # rules are compiled in order of priority, lowest first
+    priority = 0
+
+    def __init__(self, output_pin):
+        self.output_pin = output_pin
+        self.output_mask = 1 << output_pin
+
+    def compile(self, table):
+        """Adds this rule to the :class:`RuleTable`."""
+        raise NotImplementedError
+
+
+class Logic(Rule):
+    """The output pin is function(inputs), where inputs is the value of
+    the input port.
+
+    >>> Logic(4, lambda inputs: inputs & 0b11 == 0b11)  # 0 AND 1
+    """
+    def __init__(self, output_pin, function):
+        super(Logic, self).__init__(output_pin)
+        self.function = function
+
+    def compile(self, table):
+        for inputs in range(TABLE_SIZE):
+            table.drive_level(inputs, self.output_mask,
+                              bool(self.function(inputs)))
+
+
+class Follow(Logic):
+    """The output pin follows an input pin (or its inverse)."""
+    def __init__(self, output_pin, input_pin, invert=False):
+        input_mask = 1 << input_pin
+        super(Follow, self).__init__(
+            output_pin, lambda inputs: bool(inputs & input_mask) != invert)
+
+
+class Latch(Rule):
+    """The output pin turns on when the set pin turns on and stays on until
+    the reset pin turns on. Reset wins if both turn on together.
+    """
+    def __init__(self, output_pin, set_pin, reset_pin):
+        super(Latch, self).__init__(output_pin)
+        self.set_mask = 1 << set_pin
+        self.reset_mask = 1 << reset_pin
+
+    def compile(self, table):
+        table.edge_mask |= self.set_mask | self.reset_mask
+        for edges in range(TABLE_SIZE):
+            if edges & self.set_mask:
+                table.on_edge(table.rising, edges, set_mask=self.output_mask)
+            if edges & self.reset_mask:
+                table.on_edge(table.rising, edges,
+                              clear_mask=self.output_mask)
+
+
+class ToggleOnEdge(Rule):
+    """The output pin toggles when the input pin changes in direction
+    (IODIR_ON, IODIR_OFF or IODIR_BOTH).
+    """
+    def __init__(self, output_pin, input_pin, direction=IODIR_ON):
+        super(ToggleOnEdge, self).__init__(output_pin)
+        self.input_mask = 1 << input_pin
+        self.direction = direction
+
+    def compile(self, table):
+        table.edge_mask |= self.input_mask
+        edge_tables = {IODIR_ON: (table.rising,),
+                       IODIR_OFF: (table.falling,),
+                       IODIR_BOTH: (table.rising, table.falling)}
+        for edge_table in edge_tables[self.direction]:
+            for edges in range(TABLE_SIZE):
+                if edges & self.input_mask:
+                    table.on_edge(edge_table, edges,
+                                  toggle_mask=self.output_mask)
+
+
+class Interlock(Rule):
+    """The output pin is held off while any of the inhibit pins are on,
+    whatever the other rules say.
+    """
+    priority = 1
+
+    def __init__(self, output_pin, inhibit_pins):
+        super(Interlock, self).__init__(output_pin)
+        self.inhibit_mask = 0
+        for pin in inhibit_pins:
+            self.inhibit_mask |= 1 << pin
+
+    def compile(self, table):
+        for inputs in range(TABLE_SIZE):
+            if inputs & self.inhibit_mask:
+                table.drive_level(inputs, self.output_mask, False)
+
+
+class RuleTable(object):
+    """Rules compiled into lookup tables.
+
+    Edge tables are indexed by the input pins which have just turned on
+    (rising) or off (falling) and hold (or_mask, and_mask, xor_mask). The
+    level table is indexed by the input port value and holds
+    (and_mask, or_mask).
+
+    :param rules: The rules to compile.
+    :type rules: list
+    :param settle_time: Edges on a pin closer together than this are
+        treated as bouncing and ignored.
+    :type settle_time: float
+    """
+    def __init__(self, rules, settle_time=0):
+        self.rules = tuple(rules)
+        self.settle_time = settle_time
+        self.edge_mask = 0  # input pins with edge triggered rules
+        self.rising = [(0, 0xFF, 0)] * TABLE_SIZE
+        self.falling = [(0, 0xFF, 0)] * TABLE_SIZE
+        self.level = [(0xFF, 0)] * TABLE_SIZE
+        for rule in sorted(self.rules, key=lambda rule: rule.priority):
+            rule.compile(self)
+        # input pins the outputs depend on
+        self.input_mask = self.edge_mask
+        for pin in range(8):
+            pin_mask = 1 << pin
+            if any(self.level[inputs] != self.level[inputs ^ pin_mask]
+                   for inputs in range(TABLE_SIZE)):
+                self.input_mask |= pin_mask
+        self.last_inputs = 0
+        self.last_edge_time = [None] * 8
+
+    def drive_level(self, inputs, output_mask, value):
+        and_mask, or_mask = self.level[inputs]
+        and_mask &= ~output_mask
+        if value:
+            or_mask |= output_mask
+        else:
+            or_mask &= ~output_mask
+        self.level[inputs] = (and_mask, or_mask)
+
+    def on_edge(self, edge_table, edges,
+                set_mask=0, clear_mask=0, toggle_mask=0):
+        or_mask, and_mask, xor_mask = edge_table[edges]
+        edge_table[edges] = (or_mask | set_mask,
+                             and_mask & ~clear_mask,
+                             xor_mask ^ toggle_mask)
+
+    def run(self, outputs, inputs, timestamp):
+        """Returns the new output port value.
+
+        :param outputs: The current output port value.
+        :type outputs: int
+        :param inputs: The input port value.
+        :type inputs: int
+        :param timestamp: When inputs was captured.
+        :type timestamp: float
+        """
+        changed = (inputs ^ self.last_inputs) & self.edge_mask
+        if changed:
+            if self.settle_time:
+                changed = self._debounce(changed, timestamp)
+            self.last_inputs ^= changed
+            rising = changed & inputs
+            if rising:
+                or_mask, and_mask, xor_mask = self.rising[rising]
+                outputs = ((outputs | or_mask) & and_mask) ^ xor_mask
+            falling = changed & ~inputs
+            if falling:
+                or_mask, and_mask, xor_mask = self.falling[falling]
+                outputs = ((outputs | or_mask) & and_mask) ^ xor_mask
+        and_mask, or_mask = self.level[inputs]
+        return (outputs & and_mask) | or_mask
+
+    def _debounce(self, changed, timestamp):
+        for pin in range(8):
+            if changed & (1 << pin):
+                last_edge_time = self.last_edge_time[pin]
+                if last_edge_time is not None and \
+                        timestamp - last_edge_time < self.settle_time:
+                    changed &= ~(1 << pin)
+                else:
+                    self.last_edge_time[pin] = timestamp
+        return changed
@@ -0,0 +1,149 @@
+"""Runs control logic PLC style: once per period every board's inputs are
+read into a process image, the logic runs on the image and only the output
+ports it changed are written back.
+
+>>> import pifacedigitalio
+>>> from pifacedigitalio.scan import ScanCycle
+>>> pifacedigitalio.init(chip_select=(0, 1))
+>>> def logic(image):
+...     # output 0 of the first board on while inputs 0 and 1 are both on
+...     image.set_output(0, image.input(0) and image.input(1))
+...
+>>> scan = ScanCycle(logic, period=0.01)
+>>> scan.start()
+>>> scan.stats.max_cycle_ns
+412000
+
+Every input the logic sees was read in the same pass, and however many
+pins the logic reads and writes a cycle costs one SPI transaction per board
+plus one per changed output port.
+
+Reading the input port clears the board's interrupt, so don't scan a board
+which an :class:`pifacedigitalio.InputEventListener` is listening to.
+"""
+import threading
+import pifacedigitalio.core
+
+
+class ProcessImage(object):
+    """The inputs and outputs of the scanned boards, indexed in the order
+    of :attr:`ScanCycle.boards`.
+
+    :attribute: inputs -- input port values.
+    :attribute: outputs -- output port values, written after the logic.
+    """
+    def __init__(self, inputs, outputs):
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def input(self, pin_num, board=0):
+        """Returns the value of an input pin."""
+        return (self.inputs[board] >> pin_num) & 1
+
+    def output(self, pin_num, board=0):
+        """Returns the value an output pin will have."""
+        return (self.outputs[board] >> pin_num) & 1
+
+    def set_output(self, pin_num, value, board=0):
+        """Sets an output pin, written at the end of the cycle."""
+        if value:
+            self.outputs[board] |= 1 << pin_num
+        else:
+            self.outputs[board] &= ~(1 << pin_num)
+
+
+class ScanStats(object):
+    """Timing of a :class:`ScanCycle`, in nanoseconds.
+
+    :attribute: cycles -- cycles run.
+    :attribute: cycle_ns -- time taken by the last cycle.
+    :attribute: max_cycle_ns -- time taken by the longest cycle.
+    :attribute: jitter_ns -- how late the last cycle started.
+    :attribute: max_jitter_ns -- the latest any cycle has started.
+    :attribute: overruns -- cycles which took longer than the period (the
+        periods they ran into are skipped).
+    """
+    def __init__(self):
+        self.cycles = 0
+        self.cycle_ns = 0
+        self.max_cycle_ns = 0
+        self.jitter_ns = 0
+        self.max_jitter_ns = 0
+        self.overruns = 0
+
+
+class ScanCycle(object):
+    """Runs logic(image) on a :class:`ProcessImage` once every period.
+
+    :param logic: The control logic.
+    :type logic: function(image)
+    :param period: Seconds from the start of one cycle to the next.
+    :type period: float
+    :param boards: The :class:`pifacedigitalio.PiFaceDigital` boards to
+        scan (default: the boards found by :func:`pifacedigitalio.init`, in
+        bus, chip select and hardware address order).
+    :type boards: list
+    """
+    def __init__(self, logic, period, boards=None):
+        if boards is None:
+            registered = pifacedigitalio.core._pifacedigitals
+            boards = [registered[key] for key in sorted(registered)]
+        self.logic = logic
+        self.period_ns = int(period * 1e9)
+        self.boards = list(boards)
+        self.stats = ScanStats()
+        # what the outputs were last set to, by the scan or before it
+        self.written = [board.output_port.value for board in self.boards]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_cycle(self):
+        """Reads the inputs, runs the logic and writes the changed
+        outputs. Returns the :class:`ProcessImage`.
+        """
+        image = ProcessImage([board.input_port.value for board in self.boards],
+                             list(self.written))
+        self.logic(image)
+        for i, board in enumerate(self.boards):
+            outputs = image.outputs[i] & 0xFF
+            if outputs != self.written[i]:
+                board.output_port.value = outputs
+                self.written[i] = outputs
+        return image
+
+    def run(self):
+        """Runs cycles in the calling thread until :meth:`stop`."""
+        monotonic_ns = pifacedigitalio.core._monotonic_ns
+        stats = self.stats
+        due_ns = monotonic_ns()
+        while not self._stop.is_set():
+            start_ns = monotonic_ns()
+            stats.jitter_ns = start_ns - due_ns
+            stats.max_jitter_ns = max(stats.max_jitter_ns, stats.jitter_ns)
+            self.run_cycle()
+            end_ns = monotonic_ns()
+            stats.cycles += 1
+            stats.cycle_ns = end_ns - start_ns
+            stats.max_cycle_ns = max(stats.max_cycle_ns, stats.cycle_ns)
+
+            due_ns += self.period_ns
+            if end_ns > due_ns:
+                stats.overruns += 1
+                # start again on the next period boundary
+                missed = (end_ns - due_ns) // self.period_ns + 1
+                due_ns += missed * self.period_ns
+            self._stop.wait((due_ns - monotonic_ns()) / 1e9)
+
+    def start(self):
+        """Runs cycles in a background thread until :meth:`stop`."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the cycles after the current one."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,297 @@
+"""A pure Python MCP23S17 which can stand in for the SPI device and
+interrupt line of a :class:`pifacedigitalio.PiFaceDigital`, so that programs
+can be tested without any hardware.
+
+>>> from pifacedigitalio.simulator import MCP23S17Simulator
+>>> simulator = MCP23S17Simulator()
+>>> pfd = pifacedigitalio.PiFaceDigital(backend=simulator)
+>>> simulator.set_inputs(0b0101)
+>>> pfd.input_port.value
+5
+>>> simulator.play([(0.1, 0b0001), (0.2, 0b0000)])  # press switch 0
+>>> pfd.wait_for_value(0, 0, timeout=1)
+True
+
+The register file follows the datasheet for BANK=0: IOCON.HAEN addressing,
+IOCON.SEQOP, IODIR, IPOL, GPPU, GPINTEN, INTCON/DEFVAL, INTF/INTCAP and the
+INTB output (which PiFace Digital wires to the Raspberry Pi's GPIO25).
+BANK=1 is not simulated.
+
+Every register access is Python code, so the simulator runs at hundreds of
+thousands of operations per second, not millions: on CPython 3.11 about
+0.45 to 1 million single register transactions per second (reads are
+faster than writes), and roughly half that through
+:class:`pifacedigitalio.PiFaceDigital`, depending on the machine.
+"""
+import os
+import threading
+import time
+from pifacecommon.mcp23s17 import (
+    READ_CMD, IODIRA, IPOLA, GPINTENA, DEFVALA, INTCONA, IOCON, GPPUA,
+    INTFA, INTCAPA, GPIOA, OLATA, HAEN_ON, SEQOP_OFF, INT_MIRROR_ON,
+)
+
+
+NUM_REGISTERS = OLATA + 2
+MAX_CHIPS = 8
+# reading these clears the interrupt on their port
+INTERRUPT_CLEARING_REGISTERS = frozenset((GPIOA, GPIOA + 1,
+                                          INTCAPA, INTCAPA + 1))
+
+
+class SimulatedMCP23S17(object):
+    """The registers and pins of one simulated chip."""
+    def __init__(self):
+        self.registers = bytearray(NUM_REGISTERS)
+        # power on values
+        self.registers[IODIRA] = self.registers[IODIRA + 1] = 0xFF
+        self.grounded = [0, 0]  # input pins connected to ground, per port
+        self.levels = [0, 0]  # what GPIO reads, per port
+        self.flags_changed = False  # an INTF register became (non)zero
+        self.update(0)
+        self.update(1)
+
+    def update(self, port):
+        """Recalculates the pins on port (0 is A, 1 is B) and flags
+        interrupts. Returns True if an interrupt is flagged.
+        """
+        registers = self.registers
+        iodir = registers[IODIRA + port]
+        outputs = registers[OLATA + port] & ~iodir
+        # inputs are high when pulled up and not grounded
+        inputs = iodir & registers[GPPUA + port] & ~self.grounded[port]
+        level = (outputs | inputs) ^ (registers[IPOLA + port] & iodir)
+        previous = self.levels[port]
+        self.levels[port] = level
+
+        enabled = registers[GPINTENA + port] & iodir
+        intcon = registers[INTCONA + port]
+        flags = enabled & ((level ^ previous) & ~intcon |
+                           (level ^ registers[DEFVALA + port]) & intcon)
+        if flags:
+            if registers[INTFA + port] == 0:
+                registers[INTCAPA + port] = level
+                self.flags_changed = True
+            registers[INTFA + port] |= flags
+        return registers[INTFA + port] != 0
+
+    def clear_interrupt(self, port):
+        """Clears the interrupt, as reading INTCAP or GPIO does. Pins still
+        differing from DEFVAL interrupt again straight away.
+        """
+        if self.registers[INTFA + port] != 0:
+            self.registers[INTFA + port] = 0
+            self.flags_changed = True
+            self.update(port)
+
+    def interrupting(self):
+        """Returns True if INTB is active."""
+        if self.registers[IOCON] & INT_MIRROR_ON:
+            return self.registers[INTFA] != 0 or self.registers[INTFA + 1] != 0
+        else:
+            return self.registers[INTFA + 1] != 0
+
+    def read(self, address):
+        if address not in INTERRUPT_CLEARING_REGISTERS:
+            return self.registers[address]
+        port = address & 1
+        if address == GPIOA + port:
+            value = self.levels[port]
+        else:
+            value = self.registers[address]
+        self.clear_interrupt(port)
+        return value
+
+    def write(self, data, address):
+        port = address & 1
+        if address == GPIOA + port:
+            address = OLATA + port  # writing GPIO writes the latch
+        elif address in (INTFA + port, INTCAPA + port):
+            return  # read only
+        elif address == IOCON + port:
+            self.registers[IOCON] = self.registers[IOCON + 1] = data
+            return
+        self.registers[address] = data
+        self.update(port)
+
+
+class MCP23S17Simulator(object):
+    """Simulated MCP23S17s sharing one SPI chip select and interrupt line.
+    Pass it to :class:`pifacedigitalio.PiFaceDigital` as ``backend``.
+
+    :param hardware_addrs: Hardware addresses of the simulated chips
+        (default: (0,)).
+    :type hardware_addrs: list
+    """
+    def __init__(self, hardware_addrs=(0,)):
+        self.chips = [None] * MAX_CHIPS
+        for hardware_addr in hardware_addrs:
+            self.chips[hardware_addr] = SimulatedMCP23S17()
+        self.lock = threading.Lock()
+        # the line is readable while INTB is active
+        self._line_read, self._line_write = os.pipe()
+        self._line_active = False
+        self.transactions = 0
+
+    def spisend(self, bytes_to_send):
+        """Carries out an SPI transaction.
+
+        :param bytes_to_send: The bytes to send on the SPI device.
+        :type bytes_to_send: bytes
+        :returns: bytes -- returned bytes from SPI device
+        """
+        data = bytearray(bytes_to_send)
+        chip = self.chips[(data[0] >> 1) & 0x7]
+        if len(data) == 3 and chip is not None and \
+                chip.registers[IOCON] & HAEN_ON:
+            # one register on one chip: the usual case
+            with self.lock:
+                self.transactions += 1
+                if data[0] & READ_CMD:
+                    data[2] = chip.read(data[1])
+                else:
+                    chip.write(data[2], data[1])
+                    data[2] = 0
+                if chip.flags_changed:
+                    self._update_line()
+            data[0] = data[1] = 0
+            return bytes(data)
+        else:
+            return self._transfer(data)
+
+    def _transfer(self, data):
+        control_byte = data[0]
+        address = data[1]
+        with self.lock:
+            self.transactions += 1
+            chips = self._addressed_chips((control_byte >> 1) & 0x7)
+            if control_byte & READ_CMD:
+                for i in range(2, len(data)):
+                    value = 0xFF
+                    for chip in chips:
+                        value &= chip.read(address)  # wired and
+                    data[i] = value if chips else 0
+                    address = self._next_address(chips, address)
+            else:
+                for i in range(2, len(data)):
+                    for chip in chips:
+                        chip.write(data[i], address)
+                    address = self._next_address(chips, address)
+                data[2:] = bytearray(len(data) - 2)
+            self._update_line()
+        data[0] = data[1] = 0
+        return bytes(data)
+
+    def open_interrupt_line(self):
+        """Returns a file which becomes readable when the interrupt line
+        falls (see :meth:`PiFaceDigital._open_interrupt_line`).
+        """
+        return os.fdopen(os.dup(self._line_read))
+
+    def set_inputs(self, inputs, hardware_addr=0):
+        """Sets the input port as PiFace Digital sees it: a 1 bit is an
+        input connected to ground (such as a pressed switch).
+
+        :param inputs: The input port value.
+        :type inputs: int
+        :param hardware_addr: The board to change (default: 0).
+        :type hardware_addr: int
+        """
+        with self.lock:
+            chip = self.chips[hardware_addr]
+            chip.grounded[1] = inputs & 0xFF
+            chip.update(1)
+            self._update_line()
+
+    def set_input_pin(self, pin_num, value, hardware_addr=0):
+        """Sets one input pin, see :meth:`set_inputs`."""
+        with self.lock:
+            chip = self.chips[hardware_addr]
+            if value:
+                chip.grounded[1] |= 1 << pin_num
+            else:
+                chip.grounded[1] &= ~(1 << pin_num)
+            chip.update(1)
+            self._update_line()
+
+    def reset(self, hardware_addr=0):
+        """Returns a chip to its power on state, as a brown out or
+        unplugging the board would. The inputs stay as they are.
+
+        :param hardware_addr: The board to reset (default: 0).
+        :type hardware_addr: int
+        """
+        with self.lock:
+            grounded = self.chips[hardware_addr].grounded
+            chip = self.chips[hardware_addr] = SimulatedMCP23S17()
+            chip.grounded = grounded
+            chip.update(1)
+            self._update_line()
+
+    def outputs(self, hardware_addr=0):
+        """Returns the output port value of a board without an SPI
+        transaction.
+        """
+        return self.chips[hardware_addr].levels[0]
+
+    def play(self, waveform, hardware_addr=0, loop=False):
+        """Plays a waveform onto the input port of a board in a background
+        thread.
+
+        :param waveform: (seconds from start, input port value) pairs in
+            time order.
+        :type waveform: list
+        :param hardware_addr: The board to change (default: 0).
+        :type hardware_addr: int
+        :param loop: Repeat the waveform until the returned thread's
+            ``stop`` event is set (default: False).
+        :type loop: boolean
+        :returns: :class:`threading.Thread` -- the player
+        """
+        stop = threading.Event()
+        player = threading.Thread(target=self._play,
+                                  args=(list(waveform), hardware_addr, loop,
+                                        stop))
+        player.stop = stop
+        player.daemon = True
+        player.start()
+        return player
+
+    def _play(self, waveform, hardware_addr, loop, stop):
+        while not stop.is_set():
+            start = time.time()
+            for offset, inputs in waveform:
+                delay = start + offset - time.time()
+                if delay > 0 and stop.wait(delay):
+                    return
+                self.set_inputs(inputs, hardware_addr)
+            if not loop:
+                return
+
+    def _addressed_chips(self, hardware_addr):
+        chips = list()
+        for i, chip in enumerate(self.chips):
+            if chip is None:
+                continue
+            # without HAEN chips ignore the address pins
+            if i == hardware_addr or not chip.registers[IOCON] & HAEN_ON:
+                chips.append(chip)
+        return chips
+
+    def _next_address(self, chips, address):
+        if chips and chips[0].registers[IOCON] & SEQOP_OFF:
+            return address
+        else:
+            return (address + 1) % NUM_REGISTERS
+
+    def _update_line(self):
+        active = False
+        for chip in self.chips:
+            if chip is not None:
+                chip.flags_changed = False
+                active |= chip.interrupting()
+        if active and not self._line_active:
+            os.write(self._line_write, b"\0")
+        elif self._line_active and not active:
+            os.read(self._line_read, 1)
+        self._line_active = active
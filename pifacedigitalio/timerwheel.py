@@ -0,0 +1,221 @@
+"""Ends output pulses from one thread per process, however many pulses are
+running on however many boards.
+
+>>> pulse = pfd.output_pins[0].pulse(0.5)  # returns straight away
+>>> pulse.extend(0.25)                      # on for 0.75s in all
+>>> pfd.pulse_mask(0b110, 0.1).cancel()     # turn 1 and 2 off now
+
+Pulses are kept on a hashed timer wheel: a ring of slots, each holding the
+pulses ending in one tick, so starting, extending and cancelling a pulse
+take constant time. Pulses on a board ending in the same tick are turned
+off with one read-modify-write of the output port.
+
+The wheel's lock is never held during SPI transactions: pins are turned on
+and off while holding only the board's output port lock (taken before the
+wheel's lock, as by a caller inside ``pfd.port_lock``), so one slow board
+doesn't hold up pulses on the others.
+"""
+import heapq
+import logging
+import threading
+import time
+
+import pifacecommon.mcp23s17
+
+
+# Python 2 has no monotonic clock
+_monotonic = getattr(time, 'monotonic', time.time)
+
+TICK = 0.001  # seconds
+SLOTS = 512
+
+logger = logging.getLogger(__name__)
+
+_timer_wheel = None
+_timer_wheel_lock = threading.Lock()
+
+
+def timer_wheel():
+    """Returns the :class:`TimerWheel` of this process, starting it if
+    needed.
+    """
+    global _timer_wheel
+    with _timer_wheel_lock:
+        if _timer_wheel is None:
+            _timer_wheel = TimerWheel()
+        return _timer_wheel
+
+
+class Pulse(object):
+    """Output pins of one board which are on until a timer ends.
+
+    :attribute: chip -- the :class:`pifacedigitalio.PiFaceDigital`.
+    :attribute: mask -- the pins still to be turned off by this pulse.
+    """
+    def __init__(self, wheel, chip, mask, expiry_tick):
+        self.wheel = wheel
+        self.chip = chip
+        self.mask = mask
+        self.expiry_tick = expiry_tick
+
+    @property
+    def active(self):
+        """True until the pins have been turned off."""
+        return self.mask != 0
+
+    def extend(self, duration):
+        """Keeps the pins on for duration seconds longer."""
+        self.wheel.extend(self, duration)
+
+    def cancel(self, turn_off=True):
+        """Ends the pulse now.
+
+        :param turn_off: Turn the pins off, or leave them on (default: True).
+        :type turn_off: boolean
+        """
+        self.wheel.cancel(self, turn_off)
+
+
+class TimerWheel(object):
+    """Turns pulses off when their time is up. Use :func:`timer_wheel`
+    rather than making one.
+    """
+    def __init__(self, tick=TICK, slots=SLOTS):
+        self.tick = tick
+        self.slots = [set() for i in range(slots)]
+        self.start_time = _monotonic()
+        self.current_tick = 0  # the next tick to be run
+        self.pulses = 0
+        # the pulse turning off each (chip, pin_num)
+        self.pending = dict()
+        # pins of each chip whose pulses have ended, still to be turned off
+        self.clearing = dict()
+        # expiry ticks of scheduled pulses, some of them stale
+        self.deadlines = list()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def pulse(self, chip, mask, duration):
+        """Turns on the mask pins of chip's output port and returns a
+        :class:`Pulse` which turns them off after duration seconds. Pins
+        already pulsing stay on until the end of this pulse instead.
+        """
+        with chip.port_lock(pifacecommon.mcp23s17.GPIOA):
+            with self.condition:
+                for pin_num in range(8):
+                    if mask & (1 << pin_num):
+                        previous = self.pending.get((chip, pin_num))
+                        if previous is not None:
+                            self._remove_pins(previous, 1 << pin_num)
+                # pins whose last pulse just ended stay on
+                if chip in self.clearing:
+                    self.clearing[chip] &= ~mask
+                pulse = Pulse(self, chip, mask, self._tick_after(duration))
+                self._add(pulse)
+            chip.set_bits(mask)
+        return pulse
+
+    def extend(self, pulse, duration):
+        with self.condition:
+            if pulse.mask:
+                self._unschedule(pulse)
+                pulse.expiry_tick += int(-(-duration // self.tick))
+                self._schedule(pulse)
+
+    def cancel(self, pulse, turn_off=True):
+        with pulse.chip.port_lock(pifacecommon.mcp23s17.GPIOA):
+            with self.condition:
+                mask = pulse.mask
+                if mask:
+                    self._remove_pins(pulse, mask)
+            if mask and turn_off:
+                pulse.chip.clear_bits(mask)
+
+    def _tick_after(self, duration):
+        # never end early, so round up
+        end = (_monotonic() + duration - self.start_time) / self.tick
+        return max(int(-(-end // 1)), self.current_tick)
+
+    def _add(self, pulse):
+        for pin_num in range(8):
+            if pulse.mask & (1 << pin_num):
+                self.pending[(pulse.chip, pin_num)] = pulse
+        self._schedule(pulse)
+
+    def _schedule(self, pulse):
+        self.slots[pulse.expiry_tick % len(self.slots)].add(pulse)
+        self.pulses += 1
+        heapq.heappush(self.deadlines, pulse.expiry_tick)
+        self.condition.notify()
+
+    def _unschedule(self, pulse):
+        self.slots[pulse.expiry_tick % len(self.slots)].discard(pulse)
+        self.pulses -= 1
+
+    def _remove_pins(self, pulse, mask):
+        for pin_num in range(8):
+            if mask & (1 << pin_num):
+                del self.pending[(pulse.chip, pin_num)]
+        pulse.mask &= ~mask
+        if pulse.mask == 0:
+            self._unschedule(pulse)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.pulses == 0 and not self.clearing:
+                    self.condition.wait()
+                    # the ticks while idle had nothing in them
+                    self.current_tick = max(self.current_tick,
+                                            self._now_tick())
+                    continue
+                now_tick = self._now_tick()
+                # one turn of the wheel visits every slot
+                self.current_tick = max(self.current_tick,
+                                        now_tick - len(self.slots) + 1)
+                while self.current_tick <= now_tick:
+                    self._run_tick(self.current_tick)
+                    self.current_tick += 1
+                chips = list(self.clearing)
+                if not chips:
+                    self.condition.wait(self._time_to_next_pulse())
+                    continue
+            for chip in chips:
+                self._turn_off(chip)
+
+    def _now_tick(self):
+        return int((_monotonic() - self.start_time) / self.tick)
+
+    def _run_tick(self, tick):
+        slot = self.slots[tick % len(self.slots)]
+        if not slot:
+            return
+        for pulse in list(slot):
+            if pulse.expiry_tick <= tick:  # not a later turn of the wheel
+                self.clearing[pulse.chip] = \
+                    self.clearing.get(pulse.chip, 0) | pulse.mask
+                self._remove_pins(pulse, pulse.mask)
+
+    def _turn_off(self, chip):
+        try:
+            with chip.port_lock(pifacecommon.mcp23s17.GPIOA):
+                with self.condition:
+                    mask = self.clearing.pop(chip, 0)
+                if mask:
+                    chip.clear_bits(mask)
+        except Exception:
+            # keep ending the other pulses
+            logger.exception("Could not end a pulse on %r.", chip)
+
+    def _time_to_next_pulse(self):
+        deadlines = self.deadlines
+        # extended and cancelled pulses leave stale deadlines behind, which
+        # at worst wake the thread early
+        while deadlines and deadlines[0] < self.current_tick:
+            heapq.heappop(deadlines)
+        if not deadlines:
+            return None
+        return max(self.start_time + deadlines[0] * self.tick - _monotonic(),
+                   0)
@@ -0,0 +1,106 @@
+"""Watches PiFace Digital boards for resets and puts their configuration and
+outputs back.
+
+>>> from pifacedigitalio.watchdog import Watchdog
+>>> pifacedigitalio.init()
+>>> def reset(event):
+...     print("board", event.chip.hardware_addr, "was reset")
+...
+>>> watchdog = Watchdog(interval=1, on_reset=reset)
+>>> watchdog.start()
+
+A board which browns out or is unplugged and plugged back in goes back to
+its power on configuration: the outputs are inputs, the pullups are off and
+no input interrupts, so nothing the library already reads will notice. Each
+check is one burst read of a board's configuration registers, compared with
+the copy :class:`pifacedigitalio.PiFaceDigital` keeps in memory (see
+:meth:`pifacedigitalio.PiFaceDigital.check_config`), so a board is put back
+within one interval for one SPI transaction per board per interval.
+"""
+import threading
+import time
+import pifacedigitalio.core
+
+
+DEFAULT_INTERVAL = 1.0  # seconds
+
+
+class ResetEvent(object):
+    """A board which was found reset and has been put back.
+
+    :attribute: chip -- the :class:`pifacedigitalio.PiFaceDigital`.
+    :attribute: timestamp -- ``time.time()`` when it was put back.
+    :attribute: registers -- the configuration registers (IODIRA to GPPUB)
+        as they were read.
+    """
+    def __init__(self, chip, timestamp, registers):
+        self.chip = chip
+        self.timestamp = timestamp
+        self.registers = registers
+
+
+class Watchdog(object):
+    """Checks boards for resets once every interval.
+
+    :param interval: Seconds between checks (default: 1).
+    :type interval: float
+    :param boards: The :class:`pifacedigitalio.PiFaceDigital` boards to
+        check (default: the boards found by :func:`pifacedigitalio.init`).
+    :type boards: list
+    :param on_reset: Called with a :class:`ResetEvent` for each reset.
+    :type on_reset: function(event)
+    :attribute: checks -- checks run.
+    :attribute: resets -- resets found.
+    :attribute: failures -- board checks which failed because the board did
+        not answer or the SPI transfer failed (retried next interval).
+    """
+    def __init__(self, interval=DEFAULT_INTERVAL, boards=None, on_reset=None):
+        if boards is None:
+            registered = pifacedigitalio.core._pifacedigitals
+            boards = [registered[key] for key in sorted(registered)]
+        self.interval = interval
+        self.boards = list(boards)
+        self.on_reset = on_reset
+        self.checks = 0
+        self.resets = 0
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Checks every board once. Returns the :class:`ResetEvent` s."""
+        events = list()
+        for board in self.boards:
+            try:
+                registers = board.check_config()
+            except (pifacedigitalio.core.NoPiFaceDigitalDetectedError,
+                    IOError):
+                self.failures += 1
+                continue
+            if registers is not None:
+                events.append(ResetEvent(board, time.time(), registers))
+        self.checks += 1
+        self.resets += len(events)
+        if self.on_reset is not None:
+            for event in events:
+                self.on_reset(event)
+        return events
+
+    def run(self):
+        """Checks the boards in the calling thread until :meth:`stop`."""
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """Checks the boards in a background thread until :meth:`stop`."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops checking."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
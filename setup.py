@@ -28,6 +28,7 @@ setup(
     author_email='thomas.preston@openlx.org.uk',
     url='http://piface.github.io/pifacedigitalio/',
     packages=['pifacedigitalio'],
+    scripts=['bin/pifacedigitalio'],
     long_description=open('README.md').read() + open('CHANGELOG').read(),
     classifiers=[
         "License :: OSI Approved :: GNU Affero General Public License v3 or "
@@ -3,8 +3,20 @@ from __future__ import print_function
 import sys
 import unittest
 import threading
+import time
+import os
+import socket
+import subprocess
+import tempfile
+import warnings
 import pifacecommon
 import pifacedigitalio
+import pifacedigitalio.daemon
+import pifacedigitalio.exporter
+import pifacedigitalio.mirror
+import pifacedigitalio.scan
+import pifacedigitalio.simulator
+import pifacedigitalio.watchdog
 import argparse
 
 
@@ -141,6 +153,55 @@ class TestPiFaceDigitalOutput(unittest.TestCase):
             pfd.output_port.all_off()
             self.assertEqual(pfd.output_port.value, 0)
 
+    def test_bit_operations(self):
+        global pifacedigitals
+        for pfd in pifacedigitals:
+            pfd.output_port.all_off()
+            self.assertEqual(pfd.set_bits(0xA5), 0xA5)
+            self.assertEqual(pfd.clear_bits(0x05), 0xA0)
+            self.assertEqual(pfd.toggle_bits(0xFF), 0x5F)
+            self.assertEqual(pfd.output_port.value, 0x5F)
+            pfd.output_port.all_off()
+
+    def test_concurrent_toggles(self):
+        global pifacedigitals
+        for pfd in pifacedigitals:
+            pfd.output_port.all_off()
+
+            def toggle_many(pin_num):
+                for i in range(100):
+                    pfd.output_pins[pin_num].toggle()
+
+            threads = [threading.Thread(target=toggle_many, args=(i,))
+                       for i in range(OUTPUT_RANGE)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # an even number of toggles on every pin, none of them lost
+            self.assertEqual(pfd.output_port.value, 0)
+
+    def test_autotune_spi_speed(self):
+        global pifacedigitals
+        for pfd in pifacedigitals:
+            old_speed = pfd.spi_speed_hz
+            speed = pfd.autotune_spi_speed(save=False)
+            self.assertTrue(speed in pifacedigitalio.SPI_SPEEDS_HZ)
+            pfd.output_port.value = 0xAA
+            self.assertEqual(pfd.output_port.value, 0xAA)
+            pfd.output_port.all_off()
+            pfd.spi_speed_hz = old_speed
+
+    def test_attach_keeps_outputs(self):
+        global pifacedigitals
+        for pfd in pifacedigitals:
+            pfd.output_port.value = 0xAA
+            attached = pifacedigitalio.PiFaceDigital(pfd.hardware_addr,
+                                                     attach=True)
+            self.assertEqual(attached.output_port.value, 0xAA)
+            attached.output_port.all_off()
+            attached.close_fd()
+
     def tearDown(self):
         pifacedigitalio.deinit()
 
@@ -168,6 +229,15 @@ class TestPiFaceDigitalInput(unittest.TestCase):
                 bit_pattern = (1 << a) ^ (1 << b)
                 self.assertEqual(pfd.input_port.value, bit_pattern)
 
+    def test_wait_for_value(self):
+        global pifacedigitals
+        for pfd in pifacedigitals:
+            print("Press switch 0 on board {}.".format(pfd.hardware_addr))
+            self.assertTrue(pfd.wait_for_value(0, 1, timeout=10))
+            print("Release switch 0 on board {}.".format(pfd.hardware_addr))
+            self.assertTrue(pfd.wait_for_value(0, 0, timeout=10))
+            self.assertEqual(pfd.wait_for_change(mask=0x1, timeout=0.1), 0)
+
     # def test_input_pins(self):
     #     if TEST_INPUT_PORT:
     #         for i in range(INPUT_RANGE):
@@ -226,6 +296,611 @@ class TestInterrupts(unittest.TestCase):
         pifacedigitalio.deinit()
 
 
+class TestSimulator(unittest.TestCase):
+    """Tests which run against the simulator instead of a PiFace Digital."""
+    def setUp(self):
+        self.simulator = pifacedigitalio.simulator.MCP23S17Simulator(
+            hardware_addrs=(0, 3))
+        self.pfd = pifacedigitalio.PiFaceDigital(backend=self.simulator)
+
+    def test_missing_board(self):
+        self.assertRaises(pifacedigitalio.NoPiFaceDigitalDetectedError,
+                          pifacedigitalio.PiFaceDigital,
+                          hardware_addr=1,
+                          backend=self.simulator)
+
+    def test_inputs(self):
+        self.simulator.set_inputs(0b1001)
+        self.assertEqual(self.pfd.input_port.value, 0b1001)
+        self.assertEqual(self.pfd.switches[3].value, 1)
+        self.pfd.gppub.value = 0  # inputs float low without pullups
+        self.assertEqual(self.pfd.input_port.value, 0xFF)
+
+    def test_outputs(self):
+        self.pfd.output_port.value = 0xAA
+        self.assertEqual(self.simulator.outputs(), 0xAA)
+        self.pfd.relays[0].toggle()
+        self.assertEqual(self.simulator.outputs(), 0xAB)
+
+    def test_hardware_addressing(self):
+        other = pifacedigitalio.PiFaceDigital(3, backend=self.simulator)
+        other.output_port.value = 0x0F
+        self.assertEqual(self.simulator.outputs(0), 0)
+        self.assertEqual(self.simulator.outputs(3), 0x0F)
+
+    def test_interrupt_capture(self):
+        self.simulator.set_inputs(0b0100)
+        self.assertEqual(self.pfd.intfb.value, 0b0100)
+        self.assertEqual(self.pfd.intcapb.value, 0xFF ^ 0b0100)
+        self.assertEqual(self.pfd.intfb.value, 0)  # cleared by INTCAPB
+
+    def test_wait_for_value(self):
+        self.simulator.play([(0.05, 0b0001)])
+        self.assertTrue(self.pfd.wait_for_value(0, 1, timeout=1))
+        self.assertFalse(self.pfd.wait_for_value(0, 0, timeout=0.05))
+
+    def test_listener(self):
+        events = list()
+        listener = pifacedigitalio.InputEventListener(chip=self.pfd)
+        listener.register(1, pifacedigitalio.IODIR_BOTH, events.append)
+        listener.activate()
+        self.simulator.play([(0.01, 0b10), (0.05, 0b00)]).join()
+        time.sleep(0.05)
+        listener.deactivate()
+        self.assertEqual([(e.pin_num, e.direction) for e in events],
+                         [(1, pifacedigitalio.IODIR_ON),
+                          (1, pifacedigitalio.IODIR_OFF)])
+        # the edges were 40ms apart
+        self.assertAlmostEqual(
+            (events[1].timestamp_ns - events[0].timestamp_ns) / 1e9, 0.04,
+            delta=0.02)
+        for event in events:
+            self.assertGreaterEqual(event.dispatch_delay_ns, 0)
+
+    def test_callback_threads(self):
+        calls = list()
+
+        def slow(event):
+            time.sleep(0.05)
+            calls.append((event.pin_num, event.direction))
+
+        listener = pifacedigitalio.InputEventListener(
+            chip=self.pfd, callback_threads=2, slow_callback_time=0.02)
+        listener.register(0, pifacedigitalio.IODIR_BOTH, slow, settle_time=0)
+        listener.register(1, pifacedigitalio.IODIR_ON, calls.append)
+        listener.activate()
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            try:
+                self.simulator.play([(0.01, 0b01), (0.02, 0b00),
+                                     (0.03, 0b10)]).join()
+                time.sleep(0.02)
+                # pin 1 didn't wait for pin 0's slow callbacks
+                self.assertEqual(len(calls), 1)
+            finally:
+                listener.deactivate()
+        self.assertEqual([call for call in calls if call != calls[0]],
+                         [(0, pifacedigitalio.IODIR_ON),
+                          (0, pifacedigitalio.IODIR_OFF)])
+        self.assertEqual(listener.callback_stats[slow].calls, 2)
+        self.assertEqual(listener.callback_stats[slow].slow_calls, 2)
+        self.assertTrue(all(issubclass(w.category,
+                                       pifacedigitalio.SlowCallbackWarning)
+                            for w in caught))
+
+    def test_callback_errors(self):
+        calls = list()
+
+        def fail(event):
+            calls.append(event.direction)
+            raise RuntimeError("callback failed")
+
+        listener = pifacedigitalio.InputEventListener(
+            chip=self.pfd, callback_threads=1)
+        listener.register(0, pifacedigitalio.IODIR_BOTH, fail, settle_time=0)
+        listener.activate()
+        try:
+            self.simulator.play([(0.01, 0b01), (0.02, 0b00)]).join()
+            time.sleep(0.02)
+        finally:
+            listener.deactivate()
+        # the worker outlived the first exception
+        self.assertEqual(calls, [pifacedigitalio.IODIR_ON,
+                                 pifacedigitalio.IODIR_OFF])
+        self.assertEqual(listener.callback_stats[fail].errors, 2)
+
+    def test_port_events(self):
+        events = list()
+        listener = pifacedigitalio.InputEventListener(chip=self.pfd)
+        listener.register_port(events.append, mask=0x0F, window=0.03)
+        listener.activate()
+        self.simulator.play([(0.01, 0b0001), (0.02, 0b0011),
+                             (0.1, 0b10011)]).join()
+        time.sleep(0.05)
+        listener.deactivate()
+        self.assertEqual([(e.previous, e.value, e.changed) for e in events],
+                         [(0, 0b0011, 0b0011)])
+
+    def test_register_port_while_active(self):
+        pin_events, port_events = list(), list()
+        listener = pifacedigitalio.InputEventListener(chip=self.pfd)
+        listener.register(4, pifacedigitalio.IODIR_BOTH, pin_events.append,
+                          settle_time=0)
+        listener.activate()
+        try:
+            # nothing seen yet: the first change sets where the port started
+            transactions = self.simulator.transactions
+            listener.register_port(port_events.append, mask=0x0F)
+            # one write to GPINTENB, no read which would clear an interrupt
+            self.assertEqual(self.simulator.transactions, transactions + 1)
+            self.simulator.set_inputs(0b0011)
+            time.sleep(0.05)
+            self.simulator.set_inputs(0b10011)
+            time.sleep(0.05)
+            transactions = self.simulator.transactions
+            listener.register_port(port_events.append, mask=0xF0)
+            self.assertEqual(self.simulator.transactions, transactions + 1)
+            self.simulator.set_inputs(0b0011)
+            time.sleep(0.05)
+        finally:
+            listener.deactivate()
+        self.assertEqual(len(pin_events), 2)
+        self.assertEqual([(e.previous, e.value) for e in port_events],
+                         [(0, 0b0011), (0b10011, 0b0011)])
+
+    def test_event_queue_overflow(self):
+        def event(pin_num, on):
+            capture = 0xFF ^ (1 << pin_num) if on else 0xFF
+            return pifacedigitalio.InputEvent(1 << pin_num, capture,
+                                              self.pfd, 0, 0)
+
+        coalescing = pifacedigitalio.EventQueue(
+            list(), maxsize=2, overflow=pifacedigitalio.OVERFLOW_COALESCE)
+        dropping = pifacedigitalio.EventQueue(
+            list(), maxsize=2, overflow=pifacedigitalio.OVERFLOW_DROP_OLDEST)
+        for event_queue in (coalescing, dropping):
+            for pin_num, on in ((0, True), (1, True), (0, False)):
+                event_queue.put(event(pin_num, on))
+            self.assertEqual(event_queue.depth, 2)
+            self.assertEqual(event_queue.high_water, 2)
+        self.assertEqual(coalescing.coalesced, 1)
+        self.assertEqual([(e.pin_num, e.direction) for e in
+                          (coalescing.get(), coalescing.get())],
+                         [(0, pifacedigitalio.IODIR_OFF),
+                          (1, pifacedigitalio.IODIR_ON)])
+        self.assertEqual(dropping.dropped, 1)
+        self.assertEqual(dropping.get().pin_num, 1)
+
+        # signals are never dropped to make room
+        terminate = pifacedigitalio.InputEventListener.TERMINATE_SIGNAL
+        dropping = pifacedigitalio.EventQueue(
+            list(), maxsize=1, overflow=pifacedigitalio.OVERFLOW_DROP_OLDEST)
+        for thing in (event(0, True), terminate, event(1, True),
+                      event(2, True)):
+            dropping.put(thing)
+        self.assertEqual(dropping.get(), terminate)
+        self.assertEqual(dropping.get().pin_num, 2)
+
+        # closing wakes a detector waiting for room
+        blocking = pifacedigitalio.EventQueue(
+            list(), maxsize=1, overflow=pifacedigitalio.OVERFLOW_BLOCK)
+        blocking.put(event(0, True))
+        detector = threading.Thread(target=blocking.put,
+                                    args=(event(1, True),))
+        detector.daemon = True
+        detector.start()
+        blocking.close()
+        detector.join(1)
+        self.assertFalse(detector.is_alive())
+        self.assertEqual(blocking.dropped, 1)
+
+    def test_exporter(self):
+        listener = pifacedigitalio.InputEventListener(chip=self.pfd)
+        listener.register(2, pifacedigitalio.IODIR_BOTH, lambda event: None)
+        listener.register(2, pifacedigitalio.IODIR_BOTH, lambda event: None)
+        listener.activate()
+        self.pfd.output_port.value = 0x0F
+        self.simulator.set_inputs(0b100)
+        time.sleep(0.05)
+        listener.deactivate()
+        exporter = pifacedigitalio.exporter.MetricsExporter(
+            port=0, boards=[], listeners=[listener])
+        transactions = self.simulator.transactions
+        metrics = exporter.collect()
+        self.assertEqual(self.simulator.transactions, transactions)
+        self.assertIn('pifacedigitalio_output_port{board="0.0.0"} 15',
+                      metrics)
+        self.assertIn('pifacedigitalio_input_edges_total'
+                      '{board="0.0.0",listener="0",pin="2"} 1', metrics)
+        self.assertIn('pifacedigitalio_dispatch_delay_seconds_count'
+                      '{board="0.0.0",listener="0"} 1', metrics)
+        # both lambdas are one series
+        samples = [line.rsplit(" ", 1) for line in metrics.splitlines()
+                   if not line.startswith("#")]
+        names = [name for name, value in samples]
+        self.assertEqual(len(names), len(set(names)))
+        callback_counts = [value for name, value in samples
+                           if name.startswith(
+                               "pifacedigitalio_callback_seconds_count")]
+        self.assertEqual(callback_counts, ["2"])
+        self.assertEqual(
+            pifacedigitalio.exporter.escape_label_value('a"b\\c\n'),
+            'a\\"b\\\\c\\n')
+        exporter.server.server_close()
+
+    def test_autotune_spi_speed(self):
+        self.pfd.output_port.value = 0xAA
+        board = self.simulator.chips[0]
+        spisend = self.simulator.spisend
+
+        def garble_fast_transfers(bytes_to_send):
+            if self.pfd.spi_speed_hz > 4000000:
+                board.write(0x55, pifacecommon.mcp23s17.GPIOA)
+                board.write(0, pifacecommon.mcp23s17.GPPUB)
+                return bytes(bytearray(len(bytes_to_send)))
+            return spisend(bytes_to_send)
+
+        self.simulator.spisend = garble_fast_transfers
+        self.assertRaises(ValueError, self.pfd.autotune_spi_speed,
+                          speeds=(20000000,), save=False)
+        # 4MHz is the fastest that works, less the margin
+        self.assertEqual(self.pfd.autotune_spi_speed(save=False), 2000000)
+        self.assertEqual(self.simulator.outputs(), 0xAA)
+        self.assertEqual(self.pfd.gppub.value, 0xFF)
+
+    def test_interrupt_enable(self):
+        # releasing GPIO25 would stop the listener hearing the board
+        line_releases = list()
+        self.pfd.gpio_interrupts_disable = lambda: line_releases.append(1)
+        listener = pifacedigitalio.InputEventListener(chip=self.pfd)
+        listener.register(1, pifacedigitalio.IODIR_ON, lambda event: None)
+        listener.activate()
+        try:
+            self.assertEqual(self.pfd.gpintenb.value, 0b10)
+            self.simulator.set_inputs(0b01)  # no callbacks on input 0
+            self.assertEqual(self.pfd.intfb.value, 0)
+            self.pfd.set_rules([pifacedigitalio.rules.Follow(0, 2)])
+            self.assertEqual(self.pfd.gpintenb.value, 0b110)
+            self.pfd.clear_rules()
+            listener.deregister(1)
+            self.assertEqual(self.pfd.gpintenb.value, 0)
+            self.pfd.publish_state(os.path.join(tempfile.mkdtemp(), "pfd"))
+            self.assertEqual(self.pfd.gpintenb.value, 0xFF)
+        finally:
+            listener.deactivate()
+        self.assertEqual(self.pfd.gpintenb.value, 0xFF)
+        self.assertEqual(line_releases, [])
+        self.pfd.deinit_board()
+        self.assertEqual(self.pfd.gpintenb.value, 0)
+        self.assertEqual(line_releases, [1])
+
+    def test_interrupt_compare(self):
+        self.pfd.set_interrupt_compare(0b1000)
+        self.simulator.set_inputs(0b1000)
+        self.assertEqual(self.pfd.intfb.value, 0b1000)
+        self.pfd.intcapb.value
+        # still on, so still interrupting
+        self.assertEqual(self.pfd.intfb.value, 0b1000)
+        self.simulator.set_inputs(0)
+        self.pfd.intcapb.value
+        self.assertEqual(self.pfd.intfb.value, 0)
+
+    def test_configure(self):
+        gppub = pifacecommon.mcp23s17.GPPUB
+        transactions = self.simulator.transactions
+        self.assertEqual(self.pfd.config_register(gppub), 0xFF)
+        self.pfd.configure(pullups=0x0F, compare=0b1000)
+        self.assertEqual(self.simulator.transactions, transactions + 1)
+        self.pfd.configure(pullups=0x0F)  # unchanged, so not written
+        self.assertEqual(self.simulator.transactions, transactions + 1)
+        self.assertEqual(self.pfd.gppub.value, 0x0F)
+        self.assertEqual(self.pfd.intconb.value, 0b1000)
+        self.assertEqual(self.pfd.iocon.value, pifacedigitalio.IOCON_CONFIG)
+        pifacedigitalio.core._pifacedigitals[(0, 0, 0)] = self.pfd
+        try:
+            transactions = self.simulator.transactions
+            self.assertEqual(pifacedigitalio.digital_read_pullup(4), 0)
+            self.assertEqual(self.simulator.transactions, transactions)
+            pifacedigitalio.digital_write_pullup(4, 1)
+            self.assertEqual(self.pfd.gppub.value, 0x1F)
+        finally:
+            del pifacedigitalio.core._pifacedigitals[(0, 0, 0)]
+
+    def test_watchdog(self):
+        events = list()
+        board3 = pifacedigitalio.PiFaceDigital(hardware_addr=3,
+                                               backend=self.simulator)
+        watchdog = pifacedigitalio.watchdog.Watchdog(
+            boards=[self.pfd, board3], on_reset=events.append)
+        self.pfd.output_port.value = 0xA5
+        self.pfd.configure(pullups=0x0F)
+        transactions = self.simulator.transactions
+        self.assertEqual(watchdog.check(), [])
+        self.assertEqual(self.simulator.transactions, transactions + 2)
+        self.simulator.reset()
+        self.assertEqual(self.simulator.outputs(), 0)
+        watchdog.check()
+        self.assertEqual([event.chip for event in events], [self.pfd])
+        self.assertEqual(self.pfd.resets, 1)
+        self.assertEqual(board3.resets, 0)
+        self.assertEqual(self.simulator.outputs(), 0xA5)
+        self.assertEqual(self.pfd.gppub.value, 0x0F)
+        self.assertEqual(self.pfd.gpintenb.value, 0xFF)
+        self.assertEqual(self.pfd.intfb.value, 0)
+        self.assertEqual(self.pfd.iocon.value, pifacedigitalio.IOCON_CONFIG)
+
+    def test_rules(self):
+        listener = pifacedigitalio.InputEventListener(chip=self.pfd)
+        self.pfd.set_rules([pifacedigitalio.rules.ToggleOnEdge(0, 0)])
+        listener.activate()
+        self.simulator.play([(0.01, 0b1), (0.05, 0b0)]).join()
+        time.sleep(0.05)
+        listener.deactivate()
+        self.assertEqual(self.simulator.outputs(), 0b1)
+
+    def test_rule_logic(self):
+        rules = pifacedigitalio.rules
+        table = rules.RuleTable([
+            rules.Logic(4, lambda inputs: inputs & 0b11 == 0b11),
+            rules.Follow(5, 2),
+            rules.Follow(6, 2, invert=True)])
+        self.assertEqual(table.input_mask, 0b111)
+        self.assertEqual(table.edge_mask, 0)
+        self.assertEqual(table.run(0b1111, 0b001, 0), 0b01001111)
+        self.assertEqual(table.run(0, 0b011, 0), 0b01010000)
+        self.assertEqual(table.run(0, 0b111, 0), 0b00110000)
+        self.assertEqual(table.run(0, 0b100, 0), 0b00100000)
+
+    def test_rule_latch(self):
+        rules = pifacedigitalio.rules
+        table = rules.RuleTable([rules.Latch(0, 1, 2)])
+        self.assertEqual(table.input_mask, 0b110)
+        outputs = 0
+        for inputs, expected in ((0b010, 1), (0b000, 1), (0b010, 1),
+                                 (0b000, 1), (0b100, 0), (0b000, 0),
+                                 (0b110, 0)):  # reset wins
+            outputs = table.run(outputs, inputs, 0)
+            self.assertEqual(outputs, expected)
+
+    def test_rule_toggle_on_edge(self):
+        rules = pifacedigitalio.rules
+        table = rules.RuleTable([
+            rules.ToggleOnEdge(0, 0),
+            rules.ToggleOnEdge(1, 0, pifacedigitalio.IODIR_OFF),
+            rules.ToggleOnEdge(2, 0, pifacedigitalio.IODIR_BOTH)])
+        outputs = 0
+        for inputs, expected in ((1, 0b101), (0, 0b011), (0, 0b011),
+                                 (1, 0b110), (0, 0b000)):
+            outputs = table.run(outputs, inputs, 0)
+            self.assertEqual(outputs, expected)
+
+    def test_rule_interlock(self):
+        rules = pifacedigitalio.rules
+        # interlocks win whatever order the rules are given in
+        table = rules.RuleTable([
+            rules.Interlock(0, (3, 4)), rules.Follow(0, 2),
+            rules.ToggleOnEdge(1, 5), rules.Interlock(1, (3,))])
+        self.assertEqual(table.input_mask, 0b111100)
+        self.assertEqual(table.run(0, 0b000100, 0), 0b01)
+        self.assertEqual(table.run(0, 0b001100, 0), 0)
+        self.assertEqual(table.run(0, 0b010100, 0), 0)
+        self.assertEqual(table.run(0, 0b100000, 0), 0b10)
+        self.assertEqual(table.run(0b10, 0b101000, 0), 0)
+        self.assertEqual(table.run(0b10, 0b000000, 0), 0b10)
+
+    def test_rule_settle_time(self):
+        rules = pifacedigitalio.rules
+        table = rules.RuleTable([rules.ToggleOnEdge(0, 0)], settle_time=0.1)
+        outputs = 0
+        for inputs, timestamp, expected in ((1, 1.0, 1), (0, 1.01, 1),
+                                            (1, 1.02, 1), (0, 1.2, 1),
+                                            (1, 1.4, 0)):
+            outputs = table.run(outputs, inputs, timestamp)
+            self.assertEqual(outputs, expected)
+
+    def test_rule_abstract(self):
+        self.assertRaises(NotImplementedError,
+                          pifacedigitalio.rules.RuleTable,
+                          [pifacedigitalio.rules.Rule(0)])
+
+    def test_pulse(self):
+        self.pfd.output_pins[0].pulse(0.02)
+        extended = self.pfd.pulse_mask(0b110, 0.02)
+        extended.extend(0.05)
+        self.pfd.pulse_mask(0b1000, 1).cancel()
+        self.assertEqual(self.simulator.outputs(), 0b0111)
+        time.sleep(0.04)
+        self.assertEqual(self.simulator.outputs(), 0b0110)
+        time.sleep(0.05)
+        self.assertEqual(self.simulator.outputs(), 0)
+        self.assertFalse(extended.active)
+
+    def test_pulse_locking(self):
+        def pulse_while_locked():
+            deadline = time.time() + 0.1
+            while time.time() < deadline:
+                with self.pfd.port_lock(pifacecommon.mcp23s17.GPIOA):
+                    self.pfd.output_pins[0].pulse(0.001)
+
+        pulser = threading.Thread(target=pulse_while_locked)
+        pulser.daemon = True
+        pulser.start()
+        pulser.join(2)
+        self.assertFalse(pulser.is_alive())
+
+        # a board which fails doesn't stop pulses on the others
+        broken = pifacedigitalio.PiFaceDigital(3, backend=self.simulator)
+
+        def fail(mask, address=pifacecommon.mcp23s17.GPIOA):
+            raise IOError("board gone")
+
+        broken.clear_bits = fail
+        broken.output_pins[0].pulse(0.01)
+        self.pfd.output_pins[1].pulse(0.02)
+        time.sleep(0.05)
+        self.assertEqual(self.simulator.outputs(), 0)
+
+    def test_scan_cycle(self):
+        other = pifacedigitalio.PiFaceDigital(3, backend=self.simulator)
+
+        def logic(image):
+            image.outputs[1] = image.inputs[0]  # board 3 follows board 0
+            image.set_output(7, image.input(0) and image.input(1))
+
+        scan = pifacedigitalio.scan.ScanCycle(logic, period=0.005,
+                                              boards=(self.pfd, other))
+        self.simulator.set_inputs(0b11)
+        scan.run_cycle()
+        self.assertEqual(self.simulator.outputs(0), 0x80)
+        self.assertEqual(self.simulator.outputs(3), 0b11)
+        # nothing changed, so only the inputs are read
+        transactions = self.simulator.transactions
+        scan.run_cycle()
+        self.assertEqual(self.simulator.transactions - transactions, 2)
+        scan.start()
+        time.sleep(0.05)
+        scan.stop()
+        self.assertGreater(scan.stats.cycles, 5)
+
+    def test_mirror(self):
+        path = os.path.join(tempfile.mkdtemp(), "mirror")
+        publisher = self.pfd.publish_state(path)
+        mirror = pifacedigitalio.mirror.PiFaceDigitalMirror(path=path)
+        self.pfd.output_port.value = 0x81
+        self.assertEqual(mirror.output_port.value, 0x81)
+        self.assertEqual(mirror.leds[7].value, 1)
+        listener = pifacedigitalio.InputEventListener(chip=self.pfd)
+        listener.activate()
+        self.simulator.set_inputs(0b0100)
+        time.sleep(0.05)
+        listener.deactivate()
+        self.assertEqual(mirror.input_pins[2].value, 1)
+        state = mirror.read()
+        self.assertEqual(state.input_counts[2], 1)
+        self.assertEqual(state.output_counts[0], 1)
+        self.pfd.deinit_board()
+        self.assertFalse(os.path.exists(path))
+        # a change already on its way when the board was closed
+        publisher.publish_inputs(0, 0)
+        publisher.publish_outputs(0, 0)
+        self.assertEqual(mirror.read().outputs, 0x81)
+        mirror.close()
+
+    def test_mirror_header(self):
+        path = os.path.join(tempfile.mkdtemp(), "mirror")
+        size = pifacedigitalio.mirror.LAYOUT.size
+        for contents in (b"", b"PFD1", b"PFD0" + b"\0" * (size - 4),
+                         b"\0" * size):
+            with open(path, "wb") as f:
+                f.write(contents)
+            self.assertRaises(pifacedigitalio.mirror.MirrorError,
+                              pifacedigitalio.mirror.PiFaceDigitalMirror,
+                              path=path)
+
+    def test_attach(self):
+        state_file = os.path.join(tempfile.mkdtemp(), "state")
+        pfd = pifacedigitalio.PiFaceDigital(backend=self.simulator,
+                                            state_file=state_file)
+        pfd.output_port.value = 0x3C
+        pfd.configure(pullups=0x7F)
+        # restarted without deinit_board: the outputs are left alone
+        transactions = self.simulator.transactions
+        attached = pifacedigitalio.PiFaceDigital(
+            backend=self.simulator, attach=True, state_file=state_file)
+        self.assertEqual(self.simulator.outputs(), 0x3C)
+        self.assertEqual(self.simulator.transactions, transactions + 1)
+        # crashed and lost power: the last state is restored
+        attached.output_port.value = 0xC3
+        self.simulator.reset()
+        pifacedigitalio.PiFaceDigital(
+            backend=self.simulator, attach=True, state_file=state_file)
+        self.assertEqual(self.simulator.outputs(), 0xC3)
+        self.assertEqual(self.pfd.gppub.value, 0x7F)
+
+    def test_init_buses(self):
+        pifacedigitalio.init(bus=(0, 1), chip_select=(0, 1),
+                             backend=self.simulator)
+        try:
+            self.assertEqual(
+                sorted(pifacedigitalio.core._pifacedigitals),
+                [(b, c, h) for b in (0, 1) for c in (0, 1) for h in (0, 3)])
+        finally:
+            pifacedigitalio.deinit(bus=(0, 1), chip_select=(0, 1))
+        self.assertEqual(pifacedigitalio.core._pifacedigitals, dict())
+        self.assertRaises(pifacedigitalio.NoPiFaceDigitalDetectedError,
+                          pifacedigitalio.init, bus=(),
+                          backend=self.simulator)
+
+    def test_init_state_file(self):
+        state_file = os.path.join(tempfile.mkdtemp(), "state")
+        self.pfd.state_file = state_file + ".0.0.0"
+        self.pfd.output_port.value = 0x5A
+        self.pfd.save_state()
+        self.simulator.reset()  # lost power
+        pifacedigitalio.init(attach=True, backend=self.simulator,
+                             state_file=state_file)
+        try:
+            self.assertEqual(self.simulator.outputs(), 0x5A)
+            attached = pifacedigitalio.core._get_pifacedigital(0)
+            self.assertEqual(attached.state_file, state_file + ".0.0.0")
+        finally:
+            pifacedigitalio.deinit()
+
+    def test_daemon(self):
+        pifacedigitalio.core._pifacedigitals[(0, 0, 0)] = self.pfd
+        path = os.path.join(tempfile.mkdtemp(), "pifacedigitalio.sock")
+        daemon = pifacedigitalio.daemon.Daemon(path)
+        server = threading.Thread(target=daemon.serve_forever)
+        server.start()
+        try:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(path)
+            replies = client.makefile("r")
+            self.simulator.set_inputs(0b0110)
+            client.sendall(b"read 0\nwrite 0 4 1\nread 0 9\n"
+                           b"read\nwrite 0 4 1 1\n")
+            self.assertEqual(replies.readline(), "ok 6\n")
+            self.assertEqual(replies.readline(), "ok\n")
+            self.assertTrue(replies.readline().startswith("error"))
+            self.assertEqual(replies.readline(),
+                             "error wrong arguments for read\n")
+            self.assertEqual(replies.readline(),
+                             "error wrong arguments for write\n")
+            self.assertEqual(self.simulator.outputs(), 0b10000)
+            client.close()
+        finally:
+            daemon.shutdown()
+            daemon.server_close()
+            server.join()
+            del pifacedigitalio.core._pifacedigitals[(0, 0, 0)]
+
+    def test_latency(self):
+        output = subprocess.check_output(
+            [sys.executable, "-m", "pifacedigitalio.latency", "--simulate",
+             "--events", "20", "--interval", "0.001", "--write-back", "1"],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        lines = output.decode().splitlines()
+        self.assertEqual(lines[0], "20 events, 0 lost")
+        self.assertEqual(lines[1].split(),
+                         ["(us)", "p50", "p90", "p99", "p99.9", "max"])
+        stages = ("origin", "wake", "read", "queued", "dispatched",
+                  "callback", "written")
+        names = ["{}->{}".format(previous, stage)
+                 for previous, stage in zip(stages, stages[1:])]
+        names += ["origin->{}".format(stage) for stage in stages[2:]]
+        rows = [line.split() for line in lines[2:2 + len(names)]]
+        self.assertEqual([row[0] for row in rows], names)
+        for row in rows:
+            values = [float(value) for value in row[1:]]
+            self.assertEqual(len(values), 5)
+            self.assertEqual(values, sorted(values))
+            self.assertTrue(values[0] >= 0)
+        self.assertEqual(lines[2 + len(names)], "")
+        self.assertEqual(lines[3 + len(names)], "origin->written (us)")
+        counts = [int(line.split()[2]) for line in lines[4 + len(names):]]
+        self.assertEqual(sum(counts), 20)
+
+
 def remove_arg(shortarg, longarg):
     try:
         sys.argv.remove(longarg)